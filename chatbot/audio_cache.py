@@ -0,0 +1,129 @@
+from collections import OrderedDict
+import numpy as np
+import soundfile as sf
+import threading
+import tempfile
+import hashlib
+import os
+
+class AudioCache:
+    """
+    Cache a due livelli dell'audio sintetizzato: LRU in memoria e FLAC su disco.
+    Le chiavi dipendono dal testo normalizzato e dai parametri della sintesi.
+    """
+    def __init__(self, path: str, max_memory_bytes: int, max_disk_bytes: int, sample_rate: int):
+        self.path = path
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.sample_rate = sample_rate
+        self.memory: OrderedDict[str, np.ndarray] = OrderedDict()
+        self.memory_bytes = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        os.makedirs(self.path, exist_ok=True)
+        for entry in os.scandir(self.path):
+            if entry.name.endswith(".tmp"): # scritture interrotte da un arresto del server
+                os.remove(entry.path)
+        self.disk_bytes = sum(entry.stat().st_size for entry in os.scandir(self.path) if entry.name.endswith(".flac"))
+        print(f"\33[1;34m[AUDIO CACHE]\33[0m Cache inizializzata ({self.disk_bytes / 1024 / 1024:.1f} MB su disco)")
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        return " ".join(text.split()).lower()
+
+    def key(self, text: str, model: str, speaker: str, language: str, speed: float) -> str:
+        raw = "\x1f".join([self.normalize(text), model, speaker, language, f"{speed:.3f}"])
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    def file_path(self, key: str) -> str:
+        return os.path.join(self.path, f"{key}.flac")
+
+    def get(self, key: str) -> np.ndarray | None:
+        """Cerca l'audio prima in memoria e poi su disco."""
+        with self.lock:
+            audio = self.memory.get(key)
+            if audio is not None:
+                self.memory.move_to_end(key)
+                self.hits += 1
+                return audio
+        path = self.file_path(key)
+        try:
+            audio, _ = sf.read(path, dtype="float32")
+            os.utime(path) # aggiorna l'ordine di eliminazione su disco
+        except (FileNotFoundError, RuntimeError):
+            with self.lock:
+                self.misses += 1
+            return None
+        with self.lock:
+            self.hits += 1
+            self.disk_hits += 1
+            self.remember(key, audio)
+        return audio
+
+    def put(self, key: str, audio: np.ndarray):
+        """
+        Salva l'audio in memoria e su disco. Il disco è facoltativo: un errore di scrittura
+        viene solo segnalato, l'audio sintetizzato resta valido.
+        """
+        with self.lock:
+            self.remember(key, audio)
+        path = self.file_path(key)
+        # nome temporaneo unico: due sintesi della stessa frase possono salvarla insieme
+        fd, tmp_path = tempfile.mkstemp(dir=self.path, prefix=f"{key}.", suffix=".tmp")
+        os.close(fd)
+        try:
+            sf.write(tmp_path, audio, self.sample_rate, format="FLAC", subtype="PCM_16")
+            previous = os.path.getsize(path) if os.path.exists(path) else 0
+            os.replace(tmp_path, path)
+            size = os.path.getsize(path)
+        except (OSError, RuntimeError) as e:
+            print(f"\33[1;31m[AUDIO CACHE]\33[0m Salvataggio su disco fallito: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+        with self.lock:
+            self.disk_bytes += size - previous
+            if self.disk_bytes > self.max_disk_bytes:
+                self.evict_disk()
+
+    def remember(self, key: str, audio: np.ndarray):
+        old = self.memory.pop(key, None)
+        if old is not None:
+            self.memory_bytes -= old.nbytes
+        self.memory[key] = audio
+        self.memory_bytes += audio.nbytes
+        while self.memory_bytes > self.max_memory_bytes and len(self.memory) > 1:
+            _, evicted = self.memory.popitem(last=False)
+            self.memory_bytes -= evicted.nbytes
+
+    def evict_disk(self):
+        """Elimina i file usati meno di recente finché la cache rientra nel limite."""
+        entries = sorted(
+            (entry for entry in os.scandir(self.path) if entry.name.endswith(".flac")),
+            key=lambda entry: entry.stat().st_mtime
+        )
+        self.disk_bytes = sum(entry.stat().st_size for entry in entries)
+        for entry in entries:
+            if self.disk_bytes <= self.max_disk_bytes:
+                break
+            try:
+                size = entry.stat().st_size
+                os.remove(entry.path)
+                self.disk_bytes -= size
+            except FileNotFoundError:
+                pass
+
+    def stats(self) -> dict:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "memory_entries": len(self.memory),
+                "memory_bytes": self.memory_bytes,
+                "disk_bytes": self.disk_bytes
+            }
@@ -0,0 +1,107 @@
+from langchain_core.documents import Document
+from backends import get_embedder, get_reranker
+from utilities import load_config
+from hot_swap import current_version
+from sharding import ShardedFAISS
+from compression import load_index
+from dotenv import load_dotenv, find_dotenv
+from statistics import mean
+from time import perf_counter
+import numpy as np
+import argparse
+
+QUERIES = [
+    "Qual è l'iter formativo dei piloti in Accademia?",
+    "In cosa consiste la laurea in Medicina e Chirurgia?",
+    "Cosa sai dirmi sui concorsi per gli ufficiali?",
+    "Quali sono i requisiti di ammissione ai concorsi?"
+]
+
+def load_documents(db_path: str, config: dict) -> list[Document]:
+    """
+    Chunks of the database, as the chatbot loads it; the embedder is not needed to read the docstores
+    """
+    if ShardedFAISS.is_sharded(db_path):
+        vectorstores = ShardedFAISS.load_local(db_path, None, config).shards
+    else:
+        vectorstores = [load_index(db_path, None, config)]
+    return [doc for vectorstore in vectorstores for doc in vectorstore.docstore._dict.values()]
+
+def timed(func, *args) -> tuple:
+    start = perf_counter()
+    result = func(*args)
+    return result, (perf_counter() - start) * 1000
+
+def candidates(docs: list[Document], query: str, k: int) -> list[Document]:
+    """
+    Candidate documents of a query: the k with most words in common, so that the
+    comparison does not depend on any of the embedders
+    """
+    words = set(query.lower().split())
+    return sorted(docs, key=lambda d: len(words & set(d.page_content.lower().split())), reverse=True)[:k]
+
+def overlap(a: list[Document], b: list[Document]) -> float:
+    ids = lambda docs: {d.metadata.get("id") for d in docs}
+    return len(ids(a) & ids(b)) / max(len(b), 1)
+
+def main():
+    parser = argparse.ArgumentParser(description="Confronto di latenza e qualità tra i backend cohere e local")
+    parser.add_argument("--backends", nargs="+", default=["cohere", "local"], choices=["cohere", "local"])
+    parser.add_argument("--local-embedder", default="intfloat/multilingual-e5-base")
+    parser.add_argument("--local-reranker", default="cross-encoder/mmarco-mMiniLMv2-L12-H384-v1")
+    parser.add_argument("--queries", help="File con una domanda per riga")
+    parser.add_argument("--k", type=int, help="Candidati per domanda (default: k del config)")
+    args = parser.parse_args()
+
+    load_dotenv(find_dotenv())
+    config = load_config()
+    k = args.k or config['k']
+    queries = QUERIES
+    if args.queries:
+        with open(args.queries, "r", encoding="utf-8") as file:
+            queries = [line.strip() for line in file if line.strip()]
+    docs = load_documents(current_version(config['db'])[1], config)
+    pools = {query: candidates(docs, query, k) for query in queries}
+
+    results = {}
+    for backend in args.backends:
+        backend_config = {
+            **config,
+            "embedder_backend": backend,
+            "reranker_backend": backend,
+            "embedding_batching": {**config['embedding_batching'], "enabled": False} # latenza del solo modello
+        }
+        if backend == "local":
+            backend_config.update(embedder=args.local_embedder, reranker=args.local_reranker)
+        embedder, load_embedder = timed(get_embedder, backend_config)
+        reranker, load_reranker = timed(get_reranker, backend_config)
+
+        embed_times, rerank_times, embed_rankings, reranked = [], [], {}, {}
+        for query, pool in pools.items():
+            query_vector, elapsed = timed(embedder.embed_query, query)
+            embed_times.append(elapsed)
+            doc_vectors, elapsed = timed(embedder.embed_documents, [d.page_content for d in pool])
+            embed_times.append(elapsed / len(pool))
+            similarity = np.asarray(doc_vectors) @ np.asarray(query_vector)
+            embed_rankings[query] = [pool[i] for i in np.argsort(-similarity)[:config['top_n']]]
+            reranked[query], elapsed = timed(reranker.compress_documents, pool, query)
+            rerank_times.append(elapsed)
+        results[backend] = (embed_rankings, reranked)
+
+        print(f"\33[1;34m[Benchmark]\33[0m: backend {backend}")
+        print(f"    caricamento modelli: {load_embedder + load_reranker:.0f} ms")
+        print(f"    embedding: {mean(embed_times):.1f} ms per testo (p95 {np.percentile(embed_times, 95):.1f})")
+        print(f"    rerank di {k} documenti: {mean(rerank_times):.1f} ms (p95 {np.percentile(rerank_times, 95):.1f})")
+        # accordo tra il ranking per similarità e quello del reranker dello stesso backend
+        print(f"    embedding vs rerank top-{config['top_n']}: {mean(overlap(embed_rankings[q], reranked[q]) for q in queries):.2f}")
+
+    if "cohere" in results and "local" in results:
+        # Cohere come riferimento della qualità
+        embed_rankings, reranked = results["local"]
+        reference_embed, reference_rerank = results["cohere"]
+        print(f"\33[1;34m[Benchmark]\33[0m: accordo local/cohere sui top-{config['top_n']}")
+        print(f"    embedding: {mean(overlap(embed_rankings[q], reference_embed[q]) for q in queries):.2f}")
+        print(f"    rerank: {mean(overlap(reranked[q], reference_rerank[q]) for q in queries):.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.callbacks import Callbacks
+from langchain.retrievers.document_compressors.base import BaseDocumentCompressor
+from langchain_cohere import CohereRerank, CohereEmbeddings
+from typing import Any, Optional, Sequence
+from registry import registry
+from batching import MicroBatchEmbeddings
+
+def configure_threads(threads: int) -> None:
+    """
+    Limit the CPU threads used by torch for local inference (0 = all the cores)
+    """
+    import torch
+    if threads:
+        torch.set_num_threads(threads)
+
+class LocalEmbeddings(Embeddings):
+    """
+    Sentence-transformers bi-encoder running on the local CPU, optionally with ONNX Runtime.
+    Texts are encoded in batches; query and document prefixes are added for models that
+    need them (e.g. "query: " and "passage: " for E5).
+    """
+    def __init__(self, model: str, batch_size: int = 32, onnx: bool = False, threads: int = 0,
+                 query_prefix: str = "", document_prefix: str = ""):
+        from sentence_transformers import SentenceTransformer
+        configure_threads(threads)
+        kwargs = {"backend": "onnx"} if onnx else {}
+        self.model = SentenceTransformer(model, device="cpu", **kwargs)
+        self.batch_size = batch_size
+        self.query_prefix = query_prefix
+        self.document_prefix = document_prefix
+
+    def encode(self, texts: list[str]) -> list[list[float]]:
+        return self.model.encode(texts, batch_size=self.batch_size, convert_to_numpy=True, show_progress_bar=False).tolist()
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return self.encode([self.document_prefix + t for t in texts])
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.encode([self.query_prefix + text])[0]
+
+    def embed_queries(self, texts: list[str]) -> list[list[float]]:
+        return self.encode([self.query_prefix + t for t in texts])
+
+class CrossEncoderReranker(BaseDocumentCompressor):
+    """
+    Local cross-encoder reranker with the same output as CohereRerank: the best top_n
+    documents, with a relevance_score between 0 and 1 in their metadata.
+    """
+    model: Any
+    top_n: int = 3
+    batch_size: int = 32
+
+    class Config: arbitrary_types_allowed = True
+
+    def compress_documents(self, documents: Sequence[Document], query: str, callbacks: Optional[Callbacks] = None) -> Sequence[Document]:
+        if not documents:
+            return []
+        # con una sola etichetta il cross-encoder applica la sigmoide: punteggi tra 0 e 1 come Cohere
+        scores = self.model.predict([(query, d.page_content) for d in documents], batch_size=self.batch_size, show_progress_bar=False)
+        ranked = sorted(zip(documents, scores), key=lambda pair: pair[1], reverse=True)[:self.top_n]
+        return [
+            Document(page_content=doc.page_content, metadata={**doc.metadata, "relevance_score": float(score)})
+            for doc, score in ranked
+        ]
+
+def load_cross_encoder(model: str, onnx: bool = False, threads: int = 0):
+    from sentence_transformers import CrossEncoder
+    configure_threads(threads)
+    kwargs = {"backend": "onnx"} if onnx else {}
+    return CrossEncoder(model, device="cpu", **kwargs)
+
+def get_embedder(config: dict) -> Embeddings:
+    """
+    Create the embedder of the queries; it must be the one used to build the database.
+    With embedding_batching enabled the embedder is wrapped in a MicroBatchEmbeddings
+    shared by all the sessions.
+
+    Args:
+        config (dict): Configuration
+
+    Returns:
+        Embeddings: CohereEmbeddings or a local model
+    """
+    if config['embedder_backend'] == "local":
+        local = config['local_models']
+        embedder = registry.get(f"embedder:{config['embedder']}", lambda: LocalEmbeddings(
+            config['embedder'],
+            batch_size=local['batch_size'],
+            onnx=local['onnx'],
+            threads=local['threads'],
+            query_prefix=local['query_prefix'],
+            document_prefix=local['document_prefix']
+        ))
+    else:
+        embedder = CohereEmbeddings(model=config['embedder'])
+
+    batching = config['embedding_batching']
+    if not batching['enabled']:
+        return embedder
+    return registry.get(f"batcher:{config['embedder_backend']}:{config['embedder']}", lambda: MicroBatchEmbeddings(
+        embedder,
+        max_wait=batching['max_wait_ms'] / 1000,
+        max_batch=batching['max_batch'],
+        concurrency=batching['concurrency']
+    ))
+
+def get_reranker(config: dict) -> BaseDocumentCompressor:
+    """
+    Create the reranker used by the retriever
+
+    Args:
+        config (dict): Configuration
+
+    Returns:
+        BaseDocumentCompressor: CohereRerank or a local cross-encoder shared by all the sessions
+    """
+    if config['reranker_backend'] == "local":
+        local = config['local_models']
+        model = registry.get(f"reranker:{config['reranker']}", lambda: load_cross_encoder(config['reranker'], local['onnx'], local['threads']))
+        return CrossEncoderReranker(model=model, top_n=config['top_n'], batch_size=local['batch_size'])
+    return CohereRerank(model=config['reranker'], top_n=config['top_n'])
@@ -0,0 +1,114 @@
+from langchain_core.embeddings import Embeddings
+from langchain_cohere import CohereEmbeddings
+from concurrent.futures import Future, ThreadPoolExecutor
+from queue import Queue, Empty
+from time import monotonic
+import threading
+import asyncio
+
+class EmbeddingRequest():
+    def __init__(self, texts: list[str], query: bool):
+        self.texts = texts
+        self.query = query
+        self.future = Future()
+
+class MicroBatchEmbeddings(Embeddings):
+    """
+    Embedder shared by all the sessions that collects the requests arriving within
+    max_wait seconds (or until max_batch texts) and embeds them with a single call
+    to the wrapped embedder. Every caller gets its own vectors through a future.
+    """
+    def __init__(self, embedder: Embeddings, max_wait: float = 0.005, max_batch: int = 96, concurrency: int = 4):
+        self.embedder = embedder
+        self.max_wait = max_wait
+        self.max_batch = max_batch
+        self.queue = Queue()
+        self.slots = threading.Semaphore(concurrency) # le richieste si accumulano mentre i worker sono occupati
+        self.executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="embedding-batch")
+        self.thread = threading.Thread(target=self.collect, daemon=True, name="embedding-batcher")
+        self.thread.start()
+
+    def submit(self, texts: list[str], query: bool = False) -> Future:
+        """
+        Queue texts to embed
+
+        Args:
+            texts (list[str]): Texts
+            query (bool): True for search queries, False for documents
+
+        Returns:
+            Future: Future of the list of vectors
+        """
+        request = EmbeddingRequest(texts, query)
+        if not texts:
+            request.future.set_result([])
+        else:
+            self.queue.put(request)
+        return request.future
+
+    def collect(self) -> None:
+        while True:
+            self.slots.acquire()
+            batch = [self.queue.get()]
+            size = len(batch[0].texts)
+            deadline = monotonic() + self.max_wait
+            while size < self.max_batch:
+                remaining = deadline - monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    request = self.queue.get(timeout=remaining)
+                except Empty:
+                    break
+                batch.append(request)
+                size += len(request.texts)
+            self.executor.submit(self.run, batch)
+
+    def embed(self, texts: list[str], query: bool) -> list[list[float]]:
+        if query:
+            if isinstance(self.embedder, CohereEmbeddings):
+                return self.embedder.embed(texts, input_type="search_query")
+            if hasattr(self.embedder, "embed_queries"):
+                return self.embedder.embed_queries(texts)
+            return [self.embedder.embed_query(t) for t in texts]
+        return self.embedder.embed_documents(texts)
+
+    def run(self, batch: list[EmbeddingRequest]) -> None:
+        """
+        Embed a batch of requests, queries and documents separately, and hand the vectors back
+        """
+        try:
+            self.embed_batch(batch)
+        finally:
+            self.slots.release()
+
+    def embed_batch(self, batch: list[EmbeddingRequest]) -> None:
+        for query in (True, False):
+            requests = [r for r in batch if r.query == query]
+            if not requests:
+                continue
+            texts = [t for r in requests for t in r.texts]
+            try:
+                vectors = []
+                for i in range(0, len(texts), self.max_batch):
+                    vectors += self.embed(texts[i:i + self.max_batch], query)
+            except Exception as e:
+                for r in requests:
+                    r.future.set_exception(e)
+                continue
+            start = 0
+            for r in requests:
+                r.future.set_result(vectors[start:start + len(r.texts)])
+                start += len(r.texts)
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return self.submit(texts).result()
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.submit([text], query=True).result()[0]
+
+    async def aembed_documents(self, texts: list[str]) -> list[list[float]]:
+        return await asyncio.wrap_future(self.submit(texts))
+
+    async def aembed_query(self, text: str) -> list[float]:
+        return (await asyncio.wrap_future(self.submit([text], query=True)))[0]
@@ -13,7 +13,7 @@ from langchain_core.runnables import (
 from langchain_core.output_parsers import JsonOutputParser
 from langchain_core.documents import Document
 
-from retriever import Retriever
+from hot_swap import SwappableRetriever
 from utilities import ChatHistory, StdOutHandler, docs_to_string
 from abc import ABC, abstractmethod
 from random import randint
@@ -349,9 +349,10 @@ class RAGChain(HistoryAwareChain):
     - input
     """
     def __init__(self, llm: Runnable, handler: StdOutHandler | None, name: str, history: ChatHistory,
-                 retriever: Retriever, retrieval_threshold: float, followup_threshold: float, distance_threshold: float):
+                 retriever: SwappableRetriever, retrieval_threshold: float, followup_threshold: float, distance_threshold: float):
         super().__init__(llm, handler, name, history)
         self.retriever = retriever
+        self.db_version = retriever.version
         
         self.retrieval_threshold = retrieval_threshold
         self.followup_threshold = followup_threshold
@@ -387,6 +388,10 @@ class RAGChain(HistoryAwareChain):
     @debug()
     def get_ctx(self, user_input) -> str:
         relevant_docs = []
+        if self.retriever.version != self.db_version:
+            # il database è cambiato: i documenti delle risposte precedenti potrebbero non esistere più
+            self.history.forget_documents()
+            self.db_version = self.retriever.version
         # prendo i documenti che sono stati usati per rispondere alle domande precedenti
         follwoup_ctx = self.history.get_followup_ctx(self.followup_threshold)
         if follwoup_ctx:
@@ -418,7 +423,7 @@ class ChainOfThoughts(HistoryAwareChain):
     - input
     """
     def __init__(self, llm: Runnable, handler: StdOutHandler | None, name: str, history: ChatHistory,
-                 retriever: Retriever, retrieval_threshold: float, followup_threshold: float, distance_threshold: float):
+                 retriever: SwappableRetriever, retrieval_threshold: float, followup_threshold: float, distance_threshold: float):
         super().__init__(llm, handler, name, history)
         self.retriever = retriever
         
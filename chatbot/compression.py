@@ -0,0 +1,94 @@
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_community.vectorstores import FAISS
+from typing import Any, List, Tuple
+import numpy as np
+import pickle
+import json
+import faiss
+import os
+
+COMPRESSED_INDEX = "index.compressed.faiss"
+COMPRESSION_FILE = "compression.json"
+REDUCED_METHODS = ("pca", "truncate") # distanze calcolate su meno dimensioni, non confrontabili con quelle esatte
+
+def read_mapped(path: str) -> faiss.Index:
+    """
+    Read a flat index mapped from disk: only the vectors that are used are loaded.
+    IO_FLAG_MMAP maps only inverted lists, a flat index needs IO_FLAG_MMAP_IFC
+    """
+    return faiss.read_index(path, getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP))
+
+class RescoringFAISS(FAISS):
+    """
+    FAISS vectorstore searching a compressed copy of the index (fp16, int8, PQ, PCA...).
+    The best k * rescore_factor candidates are re-scored with the exact L2 distance
+    computed on the float32 vectors, read from the flat index mapped from disk.
+    """
+    def __init__(self, embedding_function, index, docstore, index_to_docstore_id, full_index: faiss.Index = None, rescore_factor: int = 4, **kwargs):
+        super().__init__(embedding_function, index, docstore, index_to_docstore_id, **kwargs)
+        self.full_index = full_index
+        self.rescore_factor = rescore_factor
+
+    @classmethod
+    def is_compressed(cls, path: str) -> bool:
+        return os.path.exists(os.path.join(path, COMPRESSED_INDEX))
+
+    @classmethod
+    def load_local(cls, folder_path: str, embeddings: Embeddings, index_name: str = "index", *, rescore_factor: int = 4, **kwargs: Any) -> "RescoringFAISS":
+        index = faiss.read_index(os.path.join(folder_path, COMPRESSED_INDEX))
+        full_index = None
+        if rescore_factor:
+            # i vettori float32 restano su disco: vengono letti solo quelli dei candidati
+            full_index = read_mapped(os.path.join(folder_path, f"{index_name}.faiss"))
+        with open(os.path.join(folder_path, f"{index_name}.pkl"), "rb") as file:
+            docstore, index_to_docstore_id = pickle.load(file)
+        print(f"\33[1;34m[RescoringFAISS]\33[0m: Caricato indice compresso con {index.ntotal} vettori")
+        return cls(embeddings, index, docstore, index_to_docstore_id, full_index=full_index, rescore_factor=rescore_factor)
+
+    def similarity_search_with_score_by_vector(self, embedding: List[float], k: int = 4, filter=None, fetch_k: int = 20, **kwargs: Any) -> List[Tuple[Document, float]]:
+        if self.full_index is None or filter is not None:
+            return super().similarity_search_with_score_by_vector(embedding, k, filter=filter, fetch_k=fetch_k, **kwargs)
+
+        vector = np.array([embedding], dtype=np.float32)
+        _, indices = self.index.search(vector, k * self.rescore_factor)
+        positions = indices[0][indices[0] >= 0]
+        if len(positions) == 0:
+            return []
+        distances = ((self.full_index.reconstruct_batch(positions) - vector) ** 2).sum(axis=1)
+        score_threshold = kwargs.get("score_threshold")
+
+        docs = []
+        for i in np.argsort(distances)[:k]:
+            if score_threshold is not None and distances[i] > score_threshold:
+                continue
+            doc = self.docstore.search(self.index_to_docstore_id[int(positions[i])])
+            if not isinstance(doc, Document):
+                raise ValueError(f"Documento in posizione {positions[i]} non trovato")
+            docs.append((doc, float(distances[i])))
+        return docs
+
+def load_index(path: str, embeddings: Embeddings, config: dict) -> FAISS:
+    """
+    Load a FAISS vectorstore, using its compressed copy if there is one and it is enabled.
+    Without re-scoring, a copy reduced with pca or truncate returns distances on fewer
+    dimensions, so it is refused when distance_threshold is set.
+
+    Args:
+        path (str): Directory of the vectorstore
+        embeddings (Embeddings): Embedder of the queries
+        config (dict): Configuration
+
+    Returns:
+        FAISS: The vectorstore
+    """
+    if config['compressed_index'] and RescoringFAISS.is_compressed(path):
+        with open(os.path.join(path, COMPRESSION_FILE), "r", encoding="utf-8") as file:
+            method = json.load(file)["method"]
+        if method in REDUCED_METHODS and not config['rescore_factor'] and config['distance_threshold']:
+            raise ValueError(
+                f"Indice compresso con {method}: con rescore_factor 0 le distanze non sono confrontabili "
+                f"con distance_threshold ({config['distance_threshold']}); usare rescore_factor > 0 o distance_threshold 0"
+            )
+        return RescoringFAISS.load_local(path, embeddings, rescore_factor=config['rescore_factor'])
+    return FAISS.load_local(path, embeddings=embeddings, allow_dangerous_deserialization=True)
@@ -0,0 +1,147 @@
+from langchain_core.documents import Document
+from retriever import Retriever, RetrieverBuilder
+from sharding import ShardedFAISS
+from collections import Counter
+from contextlib import contextmanager
+from typing import Any, Iterator
+import threading
+import os
+
+CURRENT_FILE = "CURRENT"
+VERSIONS_DIR = "versions"
+
+def current_version(root: str) -> tuple[str, str]:
+    """
+    Published version of the database, written by the vectorstore
+
+    Args:
+        root (str): Root of the database (db in the configuration)
+
+    Returns:
+        tuple[str, str]: Name and path of the version; for a database built before
+        versioning the name is empty and the path is the root
+    """
+    pointer = os.path.join(root, CURRENT_FILE)
+    if not os.path.exists(pointer):
+        return "", root
+    with open(pointer, "r", encoding="utf-8") as file:
+        name = file.read().strip()
+    return name, os.path.join(root, VERSIONS_DIR, name)
+
+class SwappableRetriever():
+    """
+    Retriever shared by the sessions whose database can be replaced while the chatbot runs.
+    Every query uses the retriever current when it starts; after a swap the old retriever
+    is released only once the queries still running on it have finished.
+    """
+    def __init__(self, retriever: Retriever, version: str):
+        self.retriever = retriever
+        self.version = version
+        self.condition = threading.Condition()
+        self.in_flight = Counter() # query in corso per versione
+        self.retired = {} # retriever sostituiti in attesa delle loro query, per versione
+        self.watcher = None
+
+    @contextmanager
+    def acquire(self) -> Iterator[Retriever]:
+        with self.condition:
+            version, retriever = self.version, self.retriever
+            self.in_flight[version] += 1
+        try:
+            yield retriever
+        finally:
+            released = None
+            with self.condition:
+                self.in_flight[version] -= 1
+                if self.in_flight[version] == 0:
+                    del self.in_flight[version]
+                    released = self.retired.pop(version, None)
+                    self.condition.notify_all()
+            if released is not None:
+                self.release(released)
+
+    @staticmethod
+    def release(retriever: Retriever) -> None:
+        if isinstance(retriever.vectorstore, ShardedFAISS):
+            retriever.vectorstore.executor.shutdown()
+
+    def invoke(self, input: str, config: Any = None, **kwargs: Any) -> list[Document]:
+        with self.acquire() as retriever:
+            return retriever.invoke(input, config, **kwargs)
+
+    async def ainvoke(self, input: str, config: Any = None, **kwargs: Any) -> list[Document]:
+        with self.acquire() as retriever:
+            return await retriever.ainvoke(input, config, **kwargs)
+
+    def swap(self, retriever: Retriever, version: str, drain_timeout: float = 60) -> None:
+        """
+        Replace the retriever: new queries use it at once, the old one is released
+        by the last query running on it. The swap waits for them at most drain_timeout seconds.
+
+        Args:
+            retriever (Retriever): Retriever of the new version of the database
+            version (str): Name of the version
+            drain_timeout (float): Maximum wait for the running queries
+        """
+        with self.condition:
+            old, old_version = self.retriever, self.version
+            self.retriever, self.version = retriever, version
+            if self.in_flight[old_version]:
+                self.retired[old_version] = old
+                old = None
+            drained = self.condition.wait_for(lambda: old_version not in self.retired, drain_timeout)
+        if old is not None:
+            self.release(old)
+        if not drained:
+            print(f"\33[1;33m[SwappableRetriever]\33[0m: Query ancora in corso sulla versione {old_version} dopo {drain_timeout}s, sarà rilasciata al loro termine")
+        print(f"\33[1;32m[SwappableRetriever]\33[0m: Database aggiornato alla versione {version}")
+
+class DatabaseWatcher():
+    """
+    Background thread checking the version pointer of the database. A new version is
+    loaded in the background, while the sessions keep answering with the current one,
+    and then swapped in between queries.
+    """
+    def __init__(self, config: dict, target: SwappableRetriever, interval: float = 10):
+        self.config = config
+        self.target = target
+        self.interval = interval
+        self.seen = target.version # anche le versioni fallite, per non ricaricarle a ogni controllo
+        self.stop = threading.Event()
+        self.thread = threading.Thread(target=self.watch, daemon=True, name="db-watcher")
+        self.thread.start()
+
+    def watch(self) -> None:
+        while not self.stop.wait(self.interval):
+            try:
+                version, path = current_version(self.config['db'])
+            except OSError as e:
+                print(f"\33[1;31m[DatabaseWatcher]\33[0m: Puntatore della versione non leggibile: {e}")
+                continue
+            if version == self.seen:
+                continue
+            self.seen = version
+            print(f"\33[1;34m[DatabaseWatcher]\33[0m: Nuova versione del database {version}, caricamento in background")
+            try:
+                retriever = RetrieverBuilder.build({**self.config, "db": path})
+            except Exception as e:
+                print(f"\33[1;31m[DatabaseWatcher]\33[0m: Versione {version} non caricata, si continua con {self.target.version}: {e}")
+                continue
+            self.target.swap(retriever, version, self.config['db_drain_timeout'])
+
+def load_retriever(config: dict) -> SwappableRetriever:
+    """
+    Build the retriever of the published version of the database and, if enabled,
+    start watching for new versions
+
+    Args:
+        config (dict): Configuration
+
+    Returns:
+        SwappableRetriever: The retriever shared by the sessions
+    """
+    version, path = current_version(config['db'])
+    retriever = SwappableRetriever(RetrieverBuilder.build({**config, "db": path}), version)
+    if config['db_watch_interval']:
+        retriever.watcher = DatabaseWatcher(config, retriever, config['db_watch_interval'])
+    return retriever
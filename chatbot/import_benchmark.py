@@ -0,0 +1,61 @@
+from statistics import median
+import subprocess
+import argparse
+import sys
+import re
+
+MODULES = ["utilities", "retriever", "chains", "session", "tts"]
+LINE = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+def import_time(module: str) -> tuple[float, list[tuple[int, int, str]]]:
+    """
+    Import a module in a new interpreter with -X importtime
+
+    Args:
+        module (str): Name of the module
+
+    Returns:
+        tuple: Total import time in seconds, (self us, cumulative us, package) of every import
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import time; start = time.perf_counter(); import {module}; print(time.perf_counter() - start)"],
+        capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+    imports = [
+        (int(match.group(1)), int(match.group(2)), match.group(4))
+        for match in map(LINE.match, result.stderr.splitlines()) if match
+    ]
+    return float(result.stdout.strip().splitlines()[-1]), imports
+
+def main():
+    parser = argparse.ArgumentParser(description="Tempo di import dei moduli del chatbot, come all'avvio di un nuovo processo")
+    parser.add_argument("--modules", nargs="+", default=MODULES)
+    parser.add_argument("--repeat", type=int, default=3, help="Processi per modulo (si riporta la mediana)")
+    parser.add_argument("--top", type=int, default=10, help="Pacchetti più lenti da mostrare per modulo")
+    args = parser.parse_args()
+
+    totals = {}
+    for module in args.modules:
+        try:
+            runs = [import_time(module) for _ in range(args.repeat)]
+        except RuntimeError as e:
+            print(f"\33[1;31m[ImportBenchmark]\33[0m: Import di {module} fallito: {e}")
+            continue
+        totals[module] = median(total for total, _ in runs)
+        self_times = {}
+        for _, imports in runs:
+            for self_us, _, package in imports:
+                self_times.setdefault(package, []).append(self_us)
+        slowest = sorted(self_times.items(), key=lambda item: median(item[1]), reverse=True)[:args.top]
+        print(f"\33[1;34m[ImportBenchmark]\33[0m: {module}: {totals[module]:.3f}s, {len(runs[0][1])} moduli importati")
+        for package, times in slowest:
+            print(f"    {median(times) / 1000:>9.1f} ms  {package}")
+
+    print(f"{'Modulo':<14}{'Import (s)':>12}")
+    for module, total in totals.items():
+        print(f"{module:<14}{total:>12.3f}")
+
+if __name__ == "__main__":
+    main()
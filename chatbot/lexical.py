@@ -0,0 +1,103 @@
+from langchain_core.documents import Document
+from langchain_community.docstore.in_memory import InMemoryDocstore
+import numpy as np
+import unicodedata
+import pickle
+import re
+import os
+
+LEXICAL_INDEX = "lexical.pkl"
+WORD = re.compile(r"\w+")
+# copia del tokenizer del vectorstore, che crea l'indice: vectorstore/tests/test_chatbot_copies.py verifica che coincidano
+STOPWORDS = {
+    "a", "ad", "al", "alla", "alle", "agli", "ai", "allo", "anche", "che", "chi", "ci", "come", "con", "cosa", "da", "dai",
+    "dal", "dalla", "dalle", "degli", "dei", "del", "della", "delle", "dello", "di", "e", "ed", "gli", "ha", "hanno", "i",
+    "il", "in", "io", "la", "le", "lo", "ma", "mi", "ne", "negli", "nei", "nel", "nella", "nelle", "non", "o", "per", "piu",
+    "quale", "quali", "quando", "questo", "questa", "se", "si", "sono", "su", "sul", "sulla", "tra", "fra", "un", "una", "uno",
+    "title", "source", "body", "description", "nurl"
+}
+
+def tokenize(text: str) -> list[str]:
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return [t for t in WORD.findall(text) if t not in STOPWORDS]
+
+def fuse(rankings: list[list[Document]], k: int = 60) -> list[Document]:
+    """
+    Reciprocal rank fusion: every document scores 1 / (k + rank) in every ranking it appears in
+
+    Args:
+        rankings (list[list[Document]]): Rankings, best first
+        k (int): Constant of the fusion, higher values flatten the difference between the ranks
+
+    Returns:
+        list[Document]: Documents of all the rankings, best first
+    """
+    scores, docs = {}, {}
+    for ranking in rankings:
+        for rank, doc in enumerate(ranking):
+            key = doc.metadata.get('id', id(doc))
+            scores[key] = scores.get(key, 0) + 1 / (k + rank + 1)
+            docs.setdefault(key, doc)
+    return [docs[key] for key in sorted(scores, key=scores.get, reverse=True)]
+
+class LexicalIndex():
+    """
+    BM25 index of the chunks of the database, built by the vectorstore together with the
+    FAISS index. The weights of the terms are precomputed, so a query only sums the
+    weights of its terms and does not need to be embedded.
+    """
+    def __init__(self, index: dict, docstores: list[InMemoryDocstore]):
+        self.ids = index["ids"]
+        self.postings = index["postings"]
+        self.docstores = docstores
+
+    @classmethod
+    def load(cls, path: str, docstores: list[InMemoryDocstore]) -> "LexicalIndex | None":
+        """
+        Load the lexical index of a database
+
+        Args:
+            path (str): Directory of the database
+            docstores (list[InMemoryDocstore]): Docstores with the chunks, one per shard
+
+        Returns:
+            LexicalIndex | None: The index, None if the database does not have one
+        """
+        index_path = os.path.join(path, LEXICAL_INDEX)
+        if not os.path.exists(index_path):
+            print("\33[1;33m[LexicalIndex]\33[0m: Indice BM25 assente, si usa solo la ricerca vettoriale")
+            return None
+        with open(index_path, "rb") as file:
+            index = pickle.load(file)
+        print(f"\33[1;34m[LexicalIndex]\33[0m: Caricato indice BM25 con {len(index['ids'])} chunks")
+        return cls(index, docstores)
+
+    def document(self, id: str) -> Document | None:
+        for docstore in self.docstores:
+            doc = docstore.search(id)
+            if isinstance(doc, Document):
+                return doc
+        return None
+
+    def search(self, query: str, k: int = 4) -> list[Document]:
+        """
+        Best k chunks by BM25 score; chunks without any term of the query are not returned
+        """
+        terms = [t for t in set(tokenize(query)) if t in self.postings]
+        if not terms:
+            return []
+        if sum(len(self.postings[t][0]) for t in terms) < len(self.ids) // 4:
+            # termini rari: si sommano solo i pesi dei chunk che li contengono
+            positions, inverse = np.unique(np.concatenate([self.postings[t][0] for t in terms]), return_inverse=True)
+            scores = np.bincount(inverse, weights=np.concatenate([self.postings[t][1] for t in terms]))
+        else:
+            positions = np.arange(len(self.ids))
+            scores = np.zeros(len(self.ids), dtype=np.float32)
+            for term in terms:
+                docs, weights = self.postings[term]
+                scores[docs] += weights
+        best = np.argpartition(-scores, k)[:k] if k < len(scores) else np.arange(len(scores))
+        best = best[np.argsort(-scores[best])]
+        docs = [self.document(self.ids[positions[i]]) for i in best if scores[i] > 0]
+        return [d for d in docs if d is not None]
@@ -0,0 +1,97 @@
+from langchain_core.documents import Document
+from langchain_core.callbacks import Callbacks
+from langchain.retrievers.document_compressors.base import BaseDocumentCompressor
+from typing import Optional, Sequence
+import re
+
+CHARS_PER_TOKEN = 4 # stima dei token senza il tokenizer del reranker
+SOURCE = re.compile(r"\\SOURCE: .*?(?=\\BODY: )", re.DOTALL)
+URL = re.compile(r"\\nURL: \S*\s*$")
+CANDIDATE = "rerank_candidate"
+
+def prune(scored: list[tuple[Document, float]], max_distance: float = 0, relative_cutoff: float = 0,
+          min_candidates: int = 0, max_candidates: int = 0) -> list[Document]:
+    """
+    Select the candidates worth reranking from a vector search: duplicates are removed,
+    then the documents farther than max_distance or than relative_cutoff times the best
+    distance are dropped, keeping at least min_candidates and at most max_candidates
+
+    Args:
+        scored (list[tuple[Document, float]]): Documents with their L2 distance from the query
+        max_distance (float): Maximum distance (0 = no limit)
+        relative_cutoff (float): Maximum ratio to the best distance (0 = no limit)
+        min_candidates (int): Candidates always kept, the nearest ones
+        max_candidates (int): Maximum number of candidates (0 = no limit)
+
+    Returns:
+        list[Document]: Candidates, nearest first
+    """
+    nearest = {}
+    for doc, distance in scored:
+        key = doc.metadata.get('id', id(doc))
+        if key not in nearest or distance < nearest[key][1]:
+            nearest[key] = (doc, distance)
+    ranked = sorted(nearest.values(), key=lambda pair: pair[1])
+    if not ranked:
+        return []
+    limit = float("inf")
+    if max_distance:
+        limit = min(limit, max_distance)
+    if relative_cutoff:
+        limit = min(limit, ranked[0][1] * relative_cutoff)
+    kept = [doc for i, (doc, distance) in enumerate(ranked) if i < min_candidates or distance <= limit]
+    return kept[:max_candidates] if max_candidates else kept
+
+def trim(text: str, tokens: int = 0) -> str:
+    """
+    Passage sent to the reranker: the chunk without its source and URL, cut to about
+    the given number of tokens on a word boundary
+
+    Args:
+        text (str): Content of the chunk
+        tokens (int): Maximum length in tokens (0 = no limit)
+
+    Returns:
+        str: Trimmed passage
+    """
+    text = URL.sub("", SOURCE.sub("", text))
+    chars = tokens * CHARS_PER_TOKEN
+    if not tokens or len(text) <= chars:
+        return text
+    cut = text.rfind(" ", 0, chars)
+    return text[:cut if cut > 0 else chars]
+
+class TrimmedReranker(BaseDocumentCompressor):
+    """
+    Reranker that sends trimmed passages to the wrapped compressor and returns the
+    original documents, with the relevance_score of their passage
+    """
+    compressor: BaseDocumentCompressor
+    passage_tokens: int = 0
+
+    def passages(self, documents: Sequence[Document]) -> list[Document]:
+        return [
+            Document(page_content=trim(doc.page_content, self.passage_tokens), metadata={**doc.metadata, CANDIDATE: i})
+            for i, doc in enumerate(documents)
+        ]
+
+    def originals(self, documents: Sequence[Document], reranked: Sequence[Document]) -> list[Document]:
+        return [
+            Document(page_content=documents[doc.metadata[CANDIDATE]].page_content, metadata={
+                **documents[doc.metadata[CANDIDATE]].metadata,
+                "relevance_score": doc.metadata["relevance_score"]
+            })
+            for doc in reranked
+        ]
+
+    def compress_documents(self, documents: Sequence[Document], query: str, callbacks: Optional[Callbacks] = None) -> Sequence[Document]:
+        if not documents:
+            return []
+        reranked = self.compressor.compress_documents(self.passages(documents), query, callbacks=callbacks)
+        return self.originals(documents, reranked)
+
+    async def acompress_documents(self, documents: Sequence[Document], query: str, callbacks: Optional[Callbacks] = None) -> Sequence[Document]:
+        if not documents:
+            return []
+        reranked = await self.compressor.acompress_documents(self.passages(documents), query, callbacks=callbacks)
+        return self.originals(documents, reranked)
@@ -0,0 +1,42 @@
+from collections import defaultdict
+from typing import Any, Callable
+import threading
+
+class Registry():
+    """
+    Process-wide store of the heavy read-only resources (retriever, vectorstore, models)
+    shared by all the Streamlit sessions. Every resource is built once, by the first
+    session asking for it, while the other sessions wait for it to be ready.
+    Sessions keep only their own state (messages, history, handler, chains).
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.building = defaultdict(threading.Lock) # un lock per risorsa: risorse diverse si costruiscono in parallelo
+        self.resources = {}
+
+    def get(self, key: str, factory: Callable[[], Any]) -> Any:
+        """
+        Get a shared resource, building it if it does not exist yet
+
+        Args:
+            key (str): Name of the resource
+            factory (Callable[[], Any]): Function building the resource
+
+        Returns:
+            Any: The resource
+        """
+        if key in self.resources:
+            return self.resources[key]
+        with self.lock:
+            building = self.building[key]
+        with building:
+            if key not in self.resources:
+                self.resources[key] = factory()
+                print(f"\33[1;32m[Registry]\33[0m: Risorsa condivisa {key} creata")
+        return self.resources[key]
+
+    def remove(self, key: str) -> None:
+        with self.lock:
+            self.resources.pop(key, None)
+
+registry = Registry() # unico per processo: i moduli importati non vengono ricaricati tra le sessioni
@@ -1,25 +1,103 @@
 from langchain_core.documents import Document
-from langchain_community.vectorstores import FAISS
-from langchain_cohere import CohereRerank, CohereEmbeddings
-from typing import Any, List
+from langchain_core.vectorstores import VectorStore
+from langchain_core.embeddings import Embeddings
+from typing import Any, Awaitable, Callable, List, Optional
 from langchain_core.retrievers import BaseRetriever, RetrieverLike
 from langchain_core.callbacks import (
+    Callbacks,
     AsyncCallbackManagerForRetrieverRun,
     CallbackManagerForRetrieverRun,
 )
 from langchain.retrievers.document_compressors.base import (
     BaseDocumentCompressor,
 )
+from sharding import ShardedFAISS
+from compression import load_index
+from backends import get_embedder, get_reranker
+from pruning import prune, TrimmedReranker
+from lexical import LexicalIndex, fuse
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from collections import Counter
+from time import monotonic
+import threading
+import asyncio
+
+STAGE_WORKERS = 4 # thread per tipo di stadio: gli stadi scaduti finiscono in background senza bloccare gli altri tipi
+STAGE_EXECUTORS: dict[str, ThreadPoolExecutor] = {}
+STAGE_EXECUTORS_LOCK = threading.Lock()
+
+def stage_executor(name: str) -> ThreadPoolExecutor:
+    with STAGE_EXECUTORS_LOCK:
+        if name not in STAGE_EXECUTORS:
+            STAGE_EXECUTORS[name] = ThreadPoolExecutor(max_workers=STAGE_WORKERS, thread_name_prefix=f"retrieval-{name}")
+        return STAGE_EXECUTORS[name]
+
+class Deadline():
+    """
+    Latency budget of a single query
+    """
+    def __init__(self, budget: float = 0):
+        self.start = monotonic()
+        self.end = self.start + budget if budget else None
+
+    def elapsed(self) -> float:
+        return monotonic() - self.start
+
+    def timeout(self, stage_limit: float | None = None) -> float | None:
+        """
+        Time available to a stage: its own limit, capped by what is left of the budget
+
+        Returns:
+            float | None: Seconds, None if there is no limit
+        """
+        limits = [limit for limit in (stage_limit, self.end - monotonic() if self.end else None) if limit is not None]
+        return min(limits) if limits else None
+
+class RetrievalStats():
+    """
+    Counters of the retrieval, shared by all the sessions
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.queries = 0
+        self.degraded = 0
+        self.skipped = Counter()
+        self.latencies = []
+
+    def record(self, latency: float, skipped: list[str]) -> None:
+        with self.lock:
+            self.queries += 1
+            self.degraded += bool(skipped)
+            self.skipped.update(skipped)
+            self.latencies = (self.latencies + [latency])[-1000:] # ultime 1000 query
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            latencies = sorted(self.latencies)
+        percentile = lambda p: latencies[min(len(latencies) - 1, int(p * len(latencies)))] if latencies else 0
+        return {
+            "queries": self.queries,
+            "degraded": self.degraded,
+            "skipped": dict(self.skipped),
+            "p50": percentile(0.5),
+            "p99": percentile(0.99)
+        }
 
 class Retriever(BaseRetriever):
     compressor: BaseDocumentCompressor
     retriever: RetrieverLike
-    embedder: CohereEmbeddings
-    vectorstore: FAISS
+    embedder: Embeddings
+    vectorstore: VectorStore
     retrieval_threshold: float
     distance_threshold: float
     simplifier: float
     config: dict
+    latency_budget: float = 0 # secondi per query, 0 = nessun limite
+    stage_deadlines: dict = {} # secondi massimi per stadio
+    pruning: dict = {"enabled": False} # selezione dei candidati prima del rerank
+    lexical: Optional[LexicalIndex] = None
+    lexical_options: dict = {"mode": "dense"} # fusione con la ricerca per parole chiave
+    stats: RetrievalStats
 
     class Config: arbitrary_types_allowed = True
 
@@ -31,6 +109,9 @@ class Retriever(BaseRetriever):
         **kwargs: Any,
     ) -> List[Document]:
         """Get documents relevant for a query.
+        Every stage has a deadline within the latency budget of the query: when the
+        reranking or the expansion do not finish in time, they are skipped and the
+        best documents found so far are returned.
 
         Args:
             query: string to find relevant documents for
@@ -39,23 +120,29 @@ class Retriever(BaseRetriever):
             Sequence of relevant documents
         """
         callbacks = run_manager.get_child()
-        docs = self.retriever.invoke(query, config={"callbacks": callbacks}, **kwargs)
+        deadline = Deadline(self.latency_budget)
+        skipped = []
+        docs, done = self.run_stage("retrieval", deadline, skipped, lambda: self.retrieve(query, callbacks, **kwargs))
+        if not done:
+            docs = self.lexical_search(query) # non serve l'embedding della domanda
         try:
             print("\33[1;34m[Retriever]\33[0m: Retrieved documents with standard method:", docs[1], len(docs))
         except Exception as e:
             print("\33[1;31m[Retriever]\33[0m: Error in printing retrieved docs")
             print(e)
         if not docs:
-            return []
+            return self.finish([], deadline, skipped)
 
-        compressed_docs = self.compressor.compress_documents(docs, query, callbacks=callbacks)
+        compressed_docs, done = self.run_stage("rerank", deadline, skipped, lambda: self.compressor.compress_documents(docs, query, callbacks=callbacks))
+        if not done:
+            return self.finish(docs[:self.config['top_n']], deadline, skipped)
         try:
             print("\33[1;34m[Retriever]\33[0m: Compressed documents after first compression:", compressed_docs[1], len(compressed_docs))
         except Exception as e:
             print("\33[1;31m[Retriever]\33[0m: Error in printing compressed docs")
             print(e)
         if not compressed_docs:
-            return []
+            return self.finish([], deadline, skipped)
 
         filtered_docs = self.filter_by_similarity(compressed_docs, self.retrieval_threshold * self.simplifier)
         try:
@@ -64,25 +151,29 @@ class Retriever(BaseRetriever):
             print("\33[1;31m[Retriever]\33[0m: Error in printing filtered docs")
             print(e)
         if not filtered_docs:
-            return []
+            return self.finish([], deadline, skipped)
 
-        similar_docs = self.search_by_vector(filtered_docs)
+        similar_docs, done = self.run_stage("expansion", deadline, skipped, lambda: self.search_by_vector(filtered_docs))
+        if not done:
+            return self.finish(filtered_docs, deadline, skipped)
         try:
             print("\33[1;34m[Retriever]\33[0m: Retrieved similar documents with vector search:", similar_docs[1], len(similar_docs))
         except Exception as e:
             print("\33[1;31m[Retriever]\33[0m: Error in printing similar docs")
             print(e)
         if not similar_docs:
-            return []
+            return self.finish([], deadline, skipped)
 
-        reranked_docs = self.compressor.compress_documents(similar_docs, query, callbacks=callbacks)
+        reranked_docs, done = self.run_stage("second_rerank", deadline, skipped, lambda: self.compressor.compress_documents(similar_docs, query, callbacks=callbacks))
+        if not done:
+            return self.finish(filtered_docs, deadline, skipped)
         try:
             print("\33[1;34m[Retriever]\33[0m: Compressed documents after second compression:", reranked_docs[1], len(reranked_docs))
         except Exception as e:
             print("\33[1;31m[Retriever]\33[0m: Error in printing reranked docs")
             print(e)
         if not reranked_docs:
-            return []
+            return self.finish([], deadline, skipped)
 
         refiltered_docs = self.filter_by_similarity(reranked_docs, self.retrieval_threshold)
         try:
@@ -91,9 +182,9 @@ class Retriever(BaseRetriever):
             print("\33[1;31m[Retriever]\33[0m: Error in printing refiltered docs")
             print(e)
         if not refiltered_docs:
-            return []
+            return self.finish([], deadline, skipped)
 
-        return sorted(refiltered_docs, key=lambda x: x.metadata.get('id'))
+        return self.finish(refiltered_docs, deadline, skipped)
         
     async def _aget_relevant_documents(
         self,
@@ -102,7 +193,7 @@ class Retriever(BaseRetriever):
         run_manager: AsyncCallbackManagerForRetrieverRun,
         **kwargs: Any,
     ) -> List[Document]:
-        """Get documents relevant for a query asynchronously.
+        """Get documents relevant for a query asynchronously, within the latency budget.
 
         Args:
             query: string to find relevant documents for
@@ -111,39 +202,181 @@ class Retriever(BaseRetriever):
             List of relevant documents
         """
         callbacks = run_manager.get_child()
+        deadline = Deadline(self.latency_budget)
+        skipped = []
 
         # Invoca il retriever in modo asincrono
-        docs = await self.retriever.ainvoke(query, config={"callbacks": callbacks}, **kwargs)
+        docs, done = await self.arun_stage("retrieval", deadline, skipped, self.aretrieve(query, callbacks, **kwargs))
+        if not done:
+            docs = self.lexical_search(query)
         if not docs:
-            return []
+            return self.finish([], deadline, skipped)
 
         # Comprime i documenti in modo asincrono
-        compressed_docs = await self.compressor.acompress_documents(docs, query, callbacks=callbacks)
+        compressed_docs, done = await self.arun_stage("rerank", deadline, skipped, self.compressor.acompress_documents(docs, query, callbacks=callbacks))
+        if not done:
+            return self.finish(docs[:self.config['top_n']], deadline, skipped)
         if not compressed_docs:
-            return []
+            return self.finish([], deadline, skipped)
 
         # Filtra i documenti per similarità in modo asincrono
         filtered_docs = await self.afilter_by_similarity(compressed_docs, self.retrieval_threshold)
         if not filtered_docs:
-            return []
+            return self.finish([], deadline, skipped)
 
         # Cerca i documenti nel vettore in modo asincrono
-        similar_docs = await self.asearch_by_vector(filtered_docs)
+        similar_docs, done = await self.arun_stage("expansion", deadline, skipped, self.asearch_by_vector(filtered_docs))
+        if not done:
+            return self.finish(filtered_docs, deadline, skipped)
         if not similar_docs:
-            return []
+            return self.finish([], deadline, skipped)
 
         # Rerank dei documenti compressi
-        reranked_docs = await self.compressor.acompress_documents(similar_docs, query, callbacks=callbacks)
+        reranked_docs, done = await self.arun_stage("second_rerank", deadline, skipped, self.compressor.acompress_documents(similar_docs, query, callbacks=callbacks))
+        if not done:
+            return self.finish(filtered_docs, deadline, skipped)
         if not reranked_docs:
-            return []
+            return self.finish([], deadline, skipped)
 
         # Filtra nuovamente per similarità
         refiltered_docs = await self.afilter_by_similarity(reranked_docs, self.retrieval_threshold)
         if not refiltered_docs:
-            return []
+            return self.finish([], deadline, skipped)
 
         # Ritorna i documenti ordinati per ID
-        return sorted(refiltered_docs, key=lambda x: x.metadata.get('id'))
+        return self.finish(refiltered_docs, deadline, skipped)
+
+    def retrieve(self, query: str, callbacks: Callbacks, **kwargs: Any) -> list[Document]:
+        """
+        First retrieval of the query: the vector search fused with the BM25 one.
+        In lexical mode, or when the embedder fails, only the BM25 results are used.
+        """
+        lexical_docs = self.lexical_search(query)
+        if self.lexical and self.lexical_options['mode'] == "lexical":
+            return lexical_docs
+        try:
+            docs = self.dense_search(query, callbacks, **kwargs)
+        except Exception as e:
+            if not self.lexical:
+                raise e
+            print(f"\33[1;33m[Retriever]\33[0m: Ricerca vettoriale fallita ({e}), si usano le parole chiave")
+            return lexical_docs
+        return self.hybrid(docs, lexical_docs)
+
+    async def aretrieve(self, query: str, callbacks: Callbacks, **kwargs: Any) -> list[Document]:
+        lexical_docs = self.lexical_search(query)
+        if self.lexical and self.lexical_options['mode'] == "lexical":
+            return lexical_docs
+        try:
+            docs = await self.adense_search(query, callbacks, **kwargs)
+        except Exception as e:
+            if not self.lexical:
+                raise e
+            print(f"\33[1;33m[Retriever]\33[0m: Ricerca vettoriale fallita ({e}), si usano le parole chiave")
+            return lexical_docs
+        return self.hybrid(docs, lexical_docs)
+
+    def dense_search(self, query: str, callbacks: Callbacks, **kwargs: Any) -> list[Document]:
+        """
+        Vector search. With pruning enabled the documents are searched with their
+        distance, so that the farthest ones are not sent to the reranker.
+        """
+        if not self.pruning['enabled']:
+            return self.retriever.invoke(query, config={"callbacks": callbacks}, **kwargs)
+        return self.candidates(self.vectorstore.similarity_search_with_score(query, k=self.config['k']))
+
+    async def adense_search(self, query: str, callbacks: Callbacks, **kwargs: Any) -> list[Document]:
+        if not self.pruning['enabled']:
+            return await self.retriever.ainvoke(query, config={"callbacks": callbacks}, **kwargs)
+        return self.candidates(await self.vectorstore.asimilarity_search_with_score(query, k=self.config['k']))
+
+    def lexical_search(self, query: str) -> list[Document]:
+        if not self.lexical or self.lexical_options['mode'] == "dense":
+            return []
+        return self.lexical.search(query, self.lexical_options['k'])
+
+    def hybrid(self, docs: list[Document], lexical_docs: list[Document]) -> list[Document]:
+        """
+        Reciprocal rank fusion of the vector and BM25 results, cut to k documents
+        """
+        if not lexical_docs:
+            return docs
+        return fuse([docs, lexical_docs], self.lexical_options['rrf_k'])[:self.config['k']]
+
+    def candidates(self, scored: list[tuple[Document, float]], adaptive: bool = True) -> list[Document]:
+        """
+        Candidates for the reranker. The adaptive cutoff only applies to the distances
+        from the query: in the expansion every document is nearest to itself.
+        """
+        return prune(
+            scored,
+            max_distance=self.pruning['max_distance'] if adaptive else 0,
+            relative_cutoff=self.pruning['relative_cutoff'] if adaptive else 0,
+            min_candidates=self.config['top_n'],
+            max_candidates=self.pruning['max_candidates']
+        )
+
+    def run_stage(self, name: str, deadline: Deadline, skipped: list[str], stage: Callable[[], Any]) -> tuple[Any, bool]:
+        """
+        Run a stage of the retrieval within its deadline.
+        Without a budget the stage runs in the calling thread; otherwise it runs in the
+        executor of its type and is abandoned when the deadline expires. The limit of the
+        stage counts from when it starts: a stage still queued behind abandoned ones is
+        cancelled after waiting as long as its limit.
+
+        Returns:
+            tuple: Result of the stage, False if it was skipped
+        """
+        limit = self.stage_deadlines.get(name)
+        timeout = deadline.timeout(limit)
+        if timeout is None:
+            return stage(), True
+        if timeout <= 0:
+            return self.skip(name, skipped, "budget esaurito")
+        started = threading.Event()
+        def run() -> Any:
+            started.set()
+            return stage()
+        future = stage_executor(name).submit(run)
+        if not started.wait(timeout) and future.cancel():
+            return self.skip(name, skipped, f"in coda da {timeout:.2f}s")
+        timeout = deadline.timeout(limit)
+        try:
+            return future.result(timeout=max(timeout, 0)), True
+        except FutureTimeoutError:
+            return self.skip(name, skipped, f"oltre {timeout:.2f}s")
+        except Exception as e:
+            if name == "retrieval":
+                raise e
+            return self.skip(name, skipped, f"errore: {e}")
+
+    async def arun_stage(self, name: str, deadline: Deadline, skipped: list[str], stage: Awaitable) -> tuple[Any, bool]:
+        timeout = deadline.timeout(self.stage_deadlines.get(name))
+        if timeout is not None and timeout <= 0:
+            stage.close()
+            return self.skip(name, skipped, "budget esaurito")
+        try:
+            return await asyncio.wait_for(stage, timeout), True
+        except asyncio.TimeoutError:
+            return self.skip(name, skipped, f"oltre {timeout:.2f}s")
+        except Exception as e:
+            if name == "retrieval" or timeout is None:
+                raise e
+            return self.skip(name, skipped, f"errore: {e}")
+
+    def skip(self, name: str, skipped: list[str], reason: str) -> tuple[None, bool]:
+        print(f"\33[1;33m[Retriever]\33[0m: Stadio {name} saltato ({reason})")
+        skipped.append(name)
+        return None, False
+
+    def finish(self, docs: list[Document], deadline: Deadline, skipped: list[str]) -> list[Document]:
+        """
+        Record the outcome of a query and sort the documents by ID
+        """
+        self.stats.record(deadline.elapsed(), skipped)
+        if skipped:
+            print(f"\33[1;33m[Retriever]\33[0m: Risposta degradata in {deadline.elapsed():.2f}s, stadi saltati: {', '.join(skipped)}")
+        return sorted(docs, key=lambda x: x.metadata.get('id'))
 
     def filter_by_similarity(self, docs: list[Document], threshold=0) -> list[Document]:
         if threshold == 0:
@@ -172,6 +405,8 @@ class Retriever(BaseRetriever):
             sim = self.vectorstore.similarity_search_with_score_by_vector(doc)
             if sim:
                 similar_docs.extend(sim)
+        if similar_docs and self.pruning['enabled']:
+            return self.candidates([(d, score) for (d, score) in similar_docs if not self.distance_threshold or score < self.distance_threshold], adaptive=False)
         if similar_docs:
             return self.filter_by_distance(similar_docs, self.distance_threshold)
         return []
@@ -183,6 +418,8 @@ class Retriever(BaseRetriever):
             sim = await self.vectorstore.asimilarity_search_with_score_by_vector(doc)
             if sim:
                 similar_docs.extend(sim)
+        if similar_docs and self.pruning['enabled']:
+            return self.candidates([(d, score) for (d, score) in similar_docs if not self.distance_threshold or score < self.distance_threshold], adaptive=False)
         if similar_docs:
             return await self.afilter_by_distance(similar_docs, self.distance_threshold)
         return []
@@ -193,10 +430,20 @@ class RetrieverBuilder():
         retrieval_threshold = config['retrieval_threshold']
         distance_threshold = config['distance_threshold']
         simplifier = config['simplifier']
-        embedder = CohereEmbeddings(model=config['embedder'])
-        vectorstore = FAISS.load_local(config['db'], embeddings=embedder, allow_dangerous_deserialization=True)
+        embedder = get_embedder(config)
+        if ShardedFAISS.is_sharded(config['db']):
+            vectorstore = ShardedFAISS.load_local(config['db'], embeddings=embedder, config=config)
+        else:
+            vectorstore = load_index(config['db'], embedder, config)
         retriever = vectorstore.as_retriever(search_type='similarity', search_kwargs={'k': config['k']})
-        compressor = CohereRerank(model=config['reranker'], top_n=config['top_n'])
+        lexical = None
+        if config['lexical']['mode'] != "dense":
+            docstores = [shard.docstore for shard in vectorstore.shards] if isinstance(vectorstore, ShardedFAISS) else [vectorstore.docstore]
+            lexical = LexicalIndex.load(config['db'], docstores)
+        compressor = get_reranker(config)
+        pruning = config['rerank_pruning']
+        if pruning['enabled'] and pruning['passage_tokens']:
+            compressor = TrimmedReranker(compressor=compressor, passage_tokens=pruning['passage_tokens'])
         print("\33[1;34m[RetrieverBuilder]\33[0m: Retriever inizializzato")
         
         return Retriever(
@@ -207,5 +454,11 @@ class RetrieverBuilder():
             retrieval_threshold=retrieval_threshold,
             distance_threshold=distance_threshold,
             simplifier=simplifier,
-            config=config
+            config=config,
+            latency_budget=config['latency_budget'],
+            stage_deadlines=config['stage_deadlines'],
+            pruning=pruning,
+            lexical=lexical,
+            lexical_options=config['lexical'],
+            stats=RetrievalStats()
         )
\ No newline at end of file
@@ -1,6 +1,7 @@
-from retriever import RetrieverBuilder
-from langchain_ollama.llms import OllamaLLM
+from hot_swap import load_retriever
 from chains import ChainOfThoughts
+from registry import registry
+from startup import executor, create_llm, warm_up_llm, TTSStatus
 from utilities import (
     load_config,
     StdOutHandler,
@@ -10,11 +11,6 @@ from utilities import (
 import streamlit as st
 import os
 
-import sounddevice as sd
-import soundfile as sf
-
-import httpx
-
 class Session():
     def __init__(self, page_title:str, title: str, icon: str, header: str = ""):
         st.set_page_config(page_title=page_title, page_icon=icon)
@@ -28,58 +24,51 @@ class Session():
         if "is_initialized" not in self.state or not self.state.is_initialized:
             self.state.is_initialized = False
             self.state.config = load_config()
+            config = self.state.config
             print("\33[1;36m[Session]\33[0m: Avvio inizializzazione")
+
+            # Retriever e LLM sono condivisi tra le sessioni e vengono creati in parallelo;
+            # il modello di Ollama e il TTS si caricano in background senza bloccare la chat.
+            # Il retriever passa da solo alle nuove versioni del database
+            retriever_future = executor.submit(registry.get, "retriever", lambda: load_retriever(config))
+            llm_future = executor.submit(registry.get, "llm", lambda: create_llm(config))
+            registry.get("llm_warmup", lambda: executor.submit(warm_up_llm, config))
+            self.state.tts = registry.get("tts", lambda: TTSStatus(config['tts_url'], timeout=config['tts_start_timeout']))
             
             # Messaggi
             self.state.messages = []
             print("\33[1;32m[Session]\33[0m: Messaggi inizializzati")
             
             # History
-            self.state.history = ChatHistory(self.state.config['history_size'])
+            self.state.history = ChatHistory(config['history_size'])
             print("\33[1;32m[Session]\33[0m: ChatHistory inizializzata")
 
             # Handler
-            self.state.handler = StdOutHandler(self.state.config, debug=False)
+            self.state.handler = StdOutHandler(config, debug=False, tts=self.state.tts)
             print("\33[1;32m[Session]\33[0m: StreamHandler inizializzato")
             
-            # Retriever
-            self.state.retriever = RetrieverBuilder.build(self.state.config)
-            if self.state.retriever is None:
+            retriever = retriever_future.result()
+            if retriever is None:
                 print("\33[1;31m[Session]\33[0m: Retriever non inizializzato")
                 return self.state.is_initialized
             print("\33[1;32m[Session]\33[0m: Retriever inizializzato")
 
-            # LLM
-            self.state.llm = OllamaLLM(
-                model=self.state.config['model']['name'],
-                base_url=self.state.config['model']['base_url'],
-                temperature=self.state.config['model']['temperature'],
-                num_ctx=self.state.config['model']['num_ctx'],
-                num_predict=self.state.config['model']['num_predict']
-            )
+            llm = llm_future.result()
             print("\33[1;32m[Session]\33[0m: LLM inizializzato")
 
             # Chain
             self.state.chain = ChainOfThoughts(
-                llm=self.state.llm,
+                llm=llm,
                 handler=self.state.handler,
                 name="ChainOfThoughts",
                 history=self.state.history,
-                retriever=self.state.retriever,
-                retrieval_threshold=self.state.config['retrieval_threshold'],
-                followup_threshold=self.state.config['followup_threshold'],
-                distance_threshold=self.state.config['distance_threshold']
+                retriever=retriever,
+                retrieval_threshold=config['retrieval_threshold'],
+                followup_threshold=config['followup_threshold'],
+                distance_threshold=config['distance_threshold']
             )
             print("\33[1;32m[Session]\33[0m: Chain inizializzata")
 
-            response = httpx.get("http://localhost:8000/start", timeout=20)
-            if response.json().get("status", 'error') == 'error':
-                error = response.json().get("message", "Error")
-                print(error)
-                raise Exception(error)
-            elif response.json().get("status", 'error') == 'ready':
-                print("\33[1;32m[Session]\33[0m: TTS inizializzato")
-
             self.state.is_initialized = True
             print("\33[1;32m[Session]\33[0m: Inizializzazione completata")
             return self.state.is_initialized
@@ -106,6 +95,9 @@ class Session():
             
             for _ in range(15):
                 st.write("")
+
+            if not self.state.tts.ready:
+                st.caption("Audio in caricamento..." if self.state.tts.status == "loading" else "Audio non disponibile")
             
             if st.button("Clear", use_container_width=True):
                 self.state.messages = []
@@ -121,9 +113,12 @@ class Session():
         
         #AUDIO
         if len(self.state.messages) >= 2:
-            if os.path.exists("tmp.wav"):
+            audio_path = self.state.handler.audio_path
+            if audio_path and os.path.exists(audio_path):
                 if st.button("Parla"):
-                    data, fs = sf.read("tmp.wav", dtype="float32")
+                    import sounddevice as sd # solo quando si riproduce l'audio
+                    import soundfile as sf
+                    data, fs = sf.read(audio_path, dtype="float32")
                     sd.play(data, fs)
                     sd.wait()
         
@@ -0,0 +1,92 @@
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+from langchain_community.vectorstores import FAISS
+from compression import load_index
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
+from typing import Any, Iterable, List, Optional, Tuple
+import asyncio
+import heapq
+import json
+import os
+
+SHARDS_FILE = "shards.json"
+
+class ShardedFAISS(VectorStore):
+    """
+    Vectorstore over several FAISS shards.
+    Every query is embedded once, searched on all shards in parallel and the partial
+    results are merged into a single top-k. New texts go to the smallest shard.
+    """
+    def __init__(self, shards: list[FAISS], embedding: Embeddings):
+        self.shards = shards
+        self.embedding = embedding
+        self.executor = ThreadPoolExecutor(max_workers=len(shards), thread_name_prefix="shard")
+
+    @classmethod
+    def is_sharded(cls, path: str) -> bool:
+        return os.path.exists(os.path.join(path, SHARDS_FILE))
+
+    @classmethod
+    def load_local(cls, path: str, embeddings: Embeddings, config: dict) -> "ShardedFAISS":
+        with open(os.path.join(path, SHARDS_FILE), "r", encoding="utf-8") as file:
+            names = json.load(file)["shards"]
+        shards = [load_index(os.path.join(path, name), embeddings, config) for name in names]
+        print(f"\33[1;34m[ShardedFAISS]\33[0m: Caricati {len(shards)} shard")
+        return cls(shards, embeddings)
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self.embedding
+
+    def _select_relevance_score_fn(self):
+        return self.shards[0]._select_relevance_score_fn()
+
+    def similarity_search_with_score_by_vector(self, embedding: List[float], k: int = 4, **kwargs: Any) -> List[Tuple[Document, float]]:
+        results = self.executor.map(
+            lambda shard: shard.similarity_search_with_score_by_vector(embedding, k, **kwargs),
+            self.shards
+        )
+        return heapq.nsmallest(k, chain.from_iterable(results), key=lambda pair: pair[1]) # distanza L2: più piccola è migliore
+
+    async def asimilarity_search_with_score_by_vector(self, embedding: List[float], k: int = 4, **kwargs: Any) -> List[Tuple[Document, float]]:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, lambda: self.similarity_search_with_score_by_vector(embedding, k, **kwargs))
+
+    def similarity_search_with_score(self, query: str, k: int = 4, **kwargs: Any) -> List[Tuple[Document, float]]:
+        return self.similarity_search_with_score_by_vector(self.embedding.embed_query(query), k, **kwargs)
+
+    async def asimilarity_search_with_score(self, query: str, k: int = 4, **kwargs: Any) -> List[Tuple[Document, float]]:
+        embedding = await self.embedding.aembed_query(query)
+        return await self.asimilarity_search_with_score_by_vector(embedding, k, **kwargs)
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score_by_vector(embedding, k, **kwargs)]
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, **kwargs)]
+
+    async def asimilarity_search(self, query: str, k: int = 4, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in await self.asimilarity_search_with_score(query, k, **kwargs)]
+
+    def add_texts(self, texts: Iterable[str], metadatas: Optional[List[dict]] = None, **kwargs: Any) -> List[str]:
+        shard = min(self.shards, key=lambda shard: shard.index.ntotal)
+        return shard.add_texts(texts, metadatas, **kwargs)
+
+    def delete(self, ids: Optional[List[str]] = None, **kwargs: Any) -> Optional[bool]:
+        if ids is None:
+            return False
+        for shard in self.shards:
+            stored = set(shard.index_to_docstore_id.values())
+            shard_ids = [id for id in ids if id in stored]
+            if shard_ids:
+                shard.delete(shard_ids)
+        return True
+
+    @classmethod
+    def from_texts(cls, texts: List[str], embedding: Embeddings, metadatas: Optional[List[dict]] = None, **kwargs: Any) -> "ShardedFAISS":
+        """
+        A vectorstore with a single shard holding the texts
+        """
+        return cls([FAISS.from_texts(texts, embedding, metadatas, **kwargs)], embedding)
@@ -0,0 +1,92 @@
+from langchain_ollama.llms import OllamaLLM
+from concurrent.futures import ThreadPoolExecutor
+from time import time, sleep
+import threading
+import httpx
+
+executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="startup") # passi indipendenti dell'avvio
+
+def create_llm(config: dict) -> OllamaLLM:
+    return OllamaLLM(
+        model=config['model']['name'],
+        base_url=config['model']['base_url'],
+        temperature=config['model']['temperature'],
+        num_ctx=config['model']['num_ctx'],
+        num_predict=config['model']['num_predict'],
+        keep_alive=config['model']['keep_alive']
+    )
+
+def warm_up_llm(config: dict) -> bool:
+    """
+    Ask Ollama to load the model in memory and keep it there, with an empty request
+
+    Args:
+        config (dict): Configuration
+
+    Returns:
+        bool: True if the model is loaded
+    """
+    start = time()
+    try:
+        response = httpx.post(
+            f"{config['model']['base_url']}/api/generate",
+            json={"model": config['model']['name'], "keep_alive": config['model']['keep_alive']},
+            timeout=config['model']['warmup_timeout']
+        )
+        response.raise_for_status()
+        print(f"\33[1;32m[Startup]\33[0m: Modello {config['model']['name']} caricato in {time() - start:.2f}s")
+        return True
+    except Exception as e:
+        print(f"\33[1;31m[Startup]\33[0m: Warm-up del modello fallito: {e}")
+        return False
+
+class TTSStatus():
+    """
+    Readiness of the TTS server, polled in a background thread until the model is loaded.
+    After an error or the timeout the server is polled again less and less often, since
+    /start retries a failed load. Responses get audio only once it is ready.
+    """
+    def __init__(self, url: str, timeout: float = 300, interval: float = 2, max_interval: float = 60):
+        self.url = url
+        self.timeout = timeout
+        self.interval = interval
+        self.max_interval = max_interval
+        self.status = "loading"
+        self.message = None
+        self.thread = threading.Thread(target=self.poll, daemon=True, name="tts-status")
+        self.thread.start()
+
+    @property
+    def ready(self) -> bool:
+        return self.status == "ready"
+
+    def check(self) -> str:
+        try:
+            response = httpx.get(f"{self.url}/start", timeout=self.interval + 5).json()
+            self.message = response.get("message")
+            return response.get("status", "error")
+        except httpx.HTTPError as e:
+            self.message = str(e)
+            return "loading" # il server potrebbe non essere ancora partito
+
+    def poll(self) -> None:
+        deadline = time() + self.timeout
+        interval = self.interval
+        while True:
+            status = self.check()
+            if status == "ready":
+                self.status = status
+                print("\33[1;32m[Startup]\33[0m: TTS inizializzato")
+                return
+            if status == "loading" and time() < deadline:
+                self.status = status
+                sleep(self.interval)
+                continue
+            if self.status != "error":
+                if status == "error":
+                    print(f"\33[1;31m[Startup]\33[0m: TTS non disponibile, nuovi tentativi in background: {self.message}")
+                else:
+                    print(f"\33[1;31m[Startup]\33[0m: TTS non pronto dopo {self.timeout}s, nuovi tentativi in background: {self.message}")
+                self.status = "error"
+            sleep(interval)
+            interval = min(interval * 2, self.max_interval)
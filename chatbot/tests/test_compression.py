@@ -0,0 +1,45 @@
+from langchain_community.embeddings import DeterministicFakeEmbedding
+from langchain_community.vectorstores import FAISS
+import numpy as np
+import pytest
+import faiss
+import json
+from compression import COMPRESSED_INDEX, COMPRESSION_FILE, RescoringFAISS, load_index
+
+embedder = DeterministicFakeEmbedding(size=32)
+
+@pytest.fixture
+def database(tmp_path):
+    """Database with a pca copy of the index, as written by the vectorstore"""
+    texts = [f"testo numero {i}" for i in range(200)]
+    FAISS.from_texts(texts, embedder).save_local(str(tmp_path))
+    flat = faiss.read_index(str(tmp_path / "index.faiss"))
+    compressed = faiss.index_factory(32, "PCA8,Flat")
+    vectors = flat.reconstruct_n(0, flat.ntotal)
+    compressed.train(vectors)
+    compressed.add(vectors)
+    faiss.write_index(compressed, str(tmp_path / COMPRESSED_INDEX))
+    (tmp_path / COMPRESSION_FILE).write_text(json.dumps({"method": "pca", "ntotal": 200, "dimension": 32}))
+    return tmp_path
+
+def options(**kwargs) -> dict:
+    return {"compressed_index": True, "rescore_factor": 4, "distance_threshold": 0.2, **kwargs}
+
+def test_rescoring_reads_exact_vectors_from_mapped_index(database):
+    vectorstore = load_index(str(database), embedder, options())
+    assert isinstance(vectorstore, RescoringFAISS)
+    exact = FAISS.load_local(str(database), embedder, allow_dangerous_deserialization=True)
+    query = embedder.embed_query("testo numero 7")
+    positions = np.arange(0, 200, 7)
+    assert np.array_equal(vectorstore.full_index.reconstruct_batch(positions), exact.index.reconstruct_batch(positions))
+
+    found = vectorstore.similarity_search_with_score_by_vector(query, k=3)
+    expected = exact.similarity_search_with_score_by_vector(query, k=3)
+    assert found[0][0].page_content == expected[0][0].page_content
+    assert found[0][1] == pytest.approx(expected[0][1], abs=1e-5)
+
+def test_reduced_distances_refused_with_threshold(database):
+    with pytest.raises(ValueError, match="rescore_factor"):
+        load_index(str(database), embedder, options(rescore_factor=0))
+    vectorstore = load_index(str(database), embedder, options(rescore_factor=0, distance_threshold=0))
+    assert vectorstore.full_index is None
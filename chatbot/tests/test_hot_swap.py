@@ -0,0 +1,96 @@
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+import hot_swap
+from hot_swap import SwappableRetriever
+
+class FakeExecutor():
+    def __init__(self):
+        self.shutdowns = 0
+
+    def shutdown(self):
+        self.shutdowns += 1
+
+class FakeVectorstore():
+    def __init__(self):
+        self.executor = FakeExecutor()
+
+class FakeRetriever():
+    """Retriever recording the queries running on it and whether it was released while busy"""
+    def __init__(self, name: str, delay: float = 0.001):
+        self.name = name
+        self.delay = delay
+        self.vectorstore = FakeVectorstore()
+        self.lock = threading.Lock()
+        self.running = 0
+        self.queries = 0
+        self.gate = threading.Event()
+        self.gate.set()
+
+    def invoke(self, input, config=None, **kwargs):
+        with self.lock:
+            assert self.vectorstore.executor.shutdowns == 0, f"{self.name} usato dopo il rilascio"
+            self.running += 1
+            self.queries += 1
+        self.gate.wait()
+        time.sleep(self.delay)
+        with self.lock:
+            self.running -= 1
+        return [self.name]
+
+def release_checked(monkeypatch):
+    monkeypatch.setattr(hot_swap, "ShardedFAISS", FakeVectorstore)
+    release = SwappableRetriever.release
+    def checked(retriever):
+        assert retriever.running == 0, f"{retriever.name} rilasciato con query in corso"
+        release(retriever)
+    monkeypatch.setattr(SwappableRetriever, "release", staticmethod(checked))
+
+def test_swap_under_concurrent_queries(monkeypatch):
+    release_checked(monkeypatch)
+    retrievers = [FakeRetriever(f"v{i}") for i in range(8)]
+    target = SwappableRetriever(retrievers[0], "v0")
+    stop = threading.Event()
+
+    def query():
+        answers = 0
+        while not stop.is_set():
+            assert target.invoke("domanda")[0].startswith("v")
+            answers += 1
+        return answers
+
+    with ThreadPoolExecutor(max_workers=6) as pool:
+        futures = [pool.submit(query) for _ in range(6)]
+        for i, retriever in enumerate(retrievers[1:], start=1):
+            time.sleep(0.02)
+            target.swap(retriever, f"v{i}", drain_timeout=5)
+        time.sleep(0.02)
+        stop.set()
+        answers = sum(f.result() for f in futures)
+
+    assert answers > 0
+    assert all(r.queries > 0 for r in retrievers)
+    assert [r.vectorstore.executor.shutdowns for r in retrievers] == [1] * 7 + [0]
+    assert target.retired == {} and not target.in_flight
+
+def test_retriever_released_after_drain_timeout(monkeypatch):
+    release_checked(monkeypatch)
+    old, new = FakeRetriever("old"), FakeRetriever("new")
+    old.gate.clear()
+    target = SwappableRetriever(old, "old")
+    with ThreadPoolExecutor(max_workers=6) as pool:
+        futures = [pool.submit(target.invoke, "domanda") for _ in range(6)]
+        while old.running < 6:
+            time.sleep(0.001)
+        target.swap(new, "new", drain_timeout=0.05)
+        assert old.vectorstore.executor.shutdowns == 0
+        assert target.invoke("domanda") == ["new"]
+        old.gate.set()
+        assert all(f.result() == ["old"] for f in futures)
+
+    assert old.vectorstore.executor.shutdowns == 1
+    assert target.retired == {} and not target.in_flight
+
+    # senza query in corso il retriever sostituito è rilasciato subito
+    target.swap(FakeRetriever("next"), "next", drain_timeout=0.05)
+    assert new.vectorstore.executor.shutdowns == 1
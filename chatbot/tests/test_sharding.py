@@ -0,0 +1,34 @@
+from langchain_community.embeddings import DeterministicFakeEmbedding
+from langchain_community.vectorstores import FAISS
+from sharding import ShardedFAISS
+
+embedder = DeterministicFakeEmbedding(size=16)
+
+def sharded() -> ShardedFAISS:
+    shards = [
+        FAISS.from_texts([f"primo {i}" for i in range(5)], embedder, ids=[f"a{i}" for i in range(5)]),
+        FAISS.from_texts([f"secondo {i}" for i in range(2)], embedder, ids=[f"b{i}" for i in range(2)])
+    ]
+    return ShardedFAISS(shards, embedder)
+
+def test_search_merges_the_shards():
+    vectorstore = sharded()
+    found = vectorstore.similarity_search_with_score("secondo 1", k=3)
+    assert found[0][0].page_content == "secondo 1" and found[0][1] == 0
+    assert [score for _, score in found] == sorted(score for _, score in found)
+
+def test_add_goes_to_the_smallest_shard_and_delete_to_its_owner():
+    vectorstore = sharded()
+    ids = vectorstore.add_texts(["nuovo testo"], [{"id": 99}], ids=["n0"])
+    assert ids == ["n0"]
+    assert [shard.index.ntotal for shard in vectorstore.shards] == [5, 3]
+    assert vectorstore.similarity_search("nuovo testo", k=1)[0].metadata == {"id": 99}
+
+    vectorstore.delete(["a0", "n0"])
+    assert [shard.index.ntotal for shard in vectorstore.shards] == [4, 2]
+    assert "nuovo testo" not in [doc.page_content for doc in vectorstore.similarity_search("nuovo testo", k=10)]
+
+def test_from_texts_builds_a_single_shard():
+    vectorstore = ShardedFAISS.from_texts(["uno", "due"], embedder)
+    assert len(vectorstore.shards) == 1
+    assert vectorstore.similarity_search("due", k=1)[0].page_content == "due"
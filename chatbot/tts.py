@@ -1,16 +1,28 @@
 from fastapi import FastAPI, BackgroundTasks
+from contextlib import asynccontextmanager
+from collections import OrderedDict
+from time import time
 import uvicorn
 import numpy as np
 import soundfile as sf
-from TTS.api import TTS
+import threading
 import asyncio
+import os
 from utilities import load_config, TextRequest
-import tiktoken
+from audio_cache import AudioCache
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Avvia il caricamento del modello all'avvio del server, senza bloccarlo."""
+    asyncio.get_running_loop().run_in_executor(None, load_maker)
+    yield
+
+app = FastAPI(lifespan=lifespan)
 config = None
-buffer = None
+buffers = None
 maker = None
+maker_lock = threading.Lock()
+load_error = None
 
 class AudioFragment:
     """Rappresenta un frammento audio generato dal TTS."""
@@ -21,119 +33,392 @@ class AudioFragment:
     def __repr__(self):
         return f"AudioFragment {self.id} (len={len(self.content)})"
 
+OUTPUT_FORMATS = { # nome -> (formato, subtype, estensione)
+    "wav_int16": ("WAV", "PCM_16", "wav"),
+    "wav_float": ("WAV", "FLOAT", "wav"),
+    "ogg_vorbis": ("OGG", "VORBIS", "ogg"),
+    "ogg_opus": ("OGG", "OPUS", "ogg")
+}
+
 class AudioBuffer:
-    """Gestisce il buffering di testi e frammenti audio."""
-    def __init__(self):
-        self.texts = []  # lista dei testi in arrivo
-        self.fragments = []  # lista dei frammenti audio
-        self.lock = asyncio.Lock()
+    """
+    Gestisce i testi e i frammenti audio di una singola risposta.
+    I frammenti vengono scritti sul file di uscita appena diventano sequenziali,
+    quindi in memoria restano solo quelli arrivati fuori ordine.
+    """
+    def __init__(self, session: str, response: int, path: str, sample_rate: int, output_format: str):
+        self.session = session
+        self.response = response
+        self.path = path
+        self.part_path = f"{path}.{response}.part"
+        self.sample_rate = sample_rate
+        self.format, self.subtype, _ = OUTPUT_FORMATS[output_format]
+        self.texts = {}  # id -> testo in arrivo
+        self.pending = {}  # id -> frammento audio non ancora scritto
+        self.written = set()
+        self.next_id = 0
+        self.writer = None
+        self.error = None
+        self.closed = False # eliminato dal manager: le sintesi ancora in corso non scrivono più
+        self.in_flight = 0 # sintesi in corso per questa risposta
+        self.last_access = time()
+        self.lock = asyncio.Lock() # solo per lo stato del buffer
+        self.write_lock = asyncio.Lock() # scritture sul file in ordine, fuori dall'event loop
+
+    @property
+    def key(self) -> str:
+        return f"{self.session}:{self.response}"
+
+    @property
+    def nbytes(self) -> int:
+        """Memoria occupata dai frammenti in attesa di essere scritti."""
+        return sum(fragment.content.nbytes for fragment in self.pending.values())
+
+    def touch(self):
+        self.last_access = time()
 
     async def add_text(self, text: str, id: int):
         """Aggiunge un testo al buffer."""
         async with self.lock:
-            self.texts.append((text, id))
-    
+            if self.closed:
+                return
+            self.texts[id] = text
+            self.touch()
+
     async def add_fragment(self, fragment: AudioFragment):
-        """Aggiunge un frammento audio al buffer."""
+        """Aggiunge un frammento audio e scrive quelli diventati sequenziali."""
         async with self.lock:
-            self.fragments.append(fragment)
+            if self.closed:
+                return
+            self.pending[fragment.id] = fragment
+            self.touch()
+            ready = []
+            while self.next_id in self.pending:
+                ready.append(self.pending.pop(self.next_id))
+                self.next_id += 1
+        if not ready:
+            return
+        # il lock di asyncio sveglia i task in ordine di arrivo, quindi i frammenti restano sequenziali;
+        # la codifica (anche Opus/Vorbis) avviene in un thread e non blocca le altre sessioni
+        async with self.write_lock:
+            if self.closed:
+                # chiuso durante l'attesa: il file non va riaperto a metà risposta
+                self.release()
+                return
+            await asyncio.to_thread(self.write, ready)
+            async with self.lock:
+                self.written.update(fragment.id for fragment in ready)
+            if self.closed:
+                self.release()
 
-    async def get_audio(self):
-        """Restituisce l'audio completo concatenando i frammenti."""
-        async with self.lock:
-            sorted_fragments = sorted(self.fragments, key=lambda x: x.id)
-            audio = np.concatenate([fragment.content for fragment in sorted_fragments])
-            return audio
+    def write(self, fragments: list[AudioFragment]):
+        if self.writer is None:
+            self.writer = sf.SoundFile(self.part_path, mode="w", samplerate=self.sample_rate, channels=1,
+                                       format=self.format, subtype=self.subtype)
+        for fragment in fragments:
+            self.writer.write(fragment.content)
 
     async def is_complete(self):
-        """Verifica se tutti i testi hanno un frammento audio associato."""
+        """Verifica se tutti i testi hanno un frammento audio scritto."""
+        async with self.lock:
+            return len(self.texts) > 0 and self.texts.keys() == self.written
+
+    async def finalize(self) -> str:
+        """Chiude il file di uscita e lo rende visibile al client."""
+        async with self.write_lock:
+            if self.closed:
+                raise RuntimeError(self.error or f"Buffer {self.key} eliminato")
+            await asyncio.to_thread(self.writer.close) # la chiusura scrive gli ultimi pacchetti codificati
+            self.writer = None
+            os.replace(self.part_path, self.path)  # il client non legge mai un file scritto a metà
+            return self.path
+
+    def close(self):
+        """
+        Libera le risorse di un buffer non completato. Il buffer resta chiuso: i frammenti
+        delle sintesi ancora in corso vengono scartati invece di riaprire il file.
+        """
+        self.closed = True
+        self.pending = {}
+        if not self.write_lock.locked(): # altrimenti il file lo chiude chi sta scrivendo
+            self.release()
+
+    def fail(self, message: str):
+        """Chiude il buffer e segnala l'errore al client alla prossima richiesta."""
+        self.error = self.error or message
+        self.close()
+
+    def release(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+        if os.path.exists(self.part_path):
+            os.remove(self.part_path)
+
+class BufferManager:
+    """Gestisce i buffer audio di tutte le sessioni attive."""
+    def __init__(self, ttl: float, max_bytes: int, output_dir: str, output_format: str, sample_rate: int):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.output_dir = output_dir
+        self.output_format = output_format
+        self.sample_rate = sample_rate
+        self.buffers: OrderedDict[str, AudioBuffer] = OrderedDict()  # ordinati dal meno recente
+        self.lock = asyncio.Lock()
+        os.makedirs(self.output_dir, exist_ok=True)
+
+    def output_path(self, session: str) -> str:
+        """Percorso del file audio di una sessione."""
+        extension = OUTPUT_FORMATS[self.output_format][2]
+        return os.path.abspath(os.path.join(self.output_dir, f"{session}.{extension}"))
+
+    async def get(self, session: str, response: int, create: bool = True) -> AudioBuffer | None:
+        """Restituisce il buffer della risposta, creandolo se necessario."""
         async with self.lock:
-            return len(self.fragments) == len(self.texts) and len(self.texts) > 0
+            self.evict_idle()
+            key = f"{session}:{response}"
+            buffer = self.buffers.get(key)
+            if buffer is None and create:
+                # Una nuova risposta rende obsolete quelle precedenti della stessa sessione
+                for old_key in [k for k, b in self.buffers.items() if b.session == session]:
+                    self.buffers.pop(old_key).close()
+                buffer = AudioBuffer(session, response, self.output_path(session), self.sample_rate, self.output_format)
+                self.buffers[key] = buffer
+            if buffer is not None:
+                buffer.touch()
+                self.buffers.move_to_end(key)
+            return buffer
+
+    async def remove(self, buffer: AudioBuffer):
+        async with self.lock:
+            if self.buffers.get(buffer.key) is buffer:
+                del self.buffers[buffer.key]
+            buffer.close()
+
+    def evict_idle(self):
+        """
+        Elimina i buffer inattivi da più di ttl secondi, tranne quelli con sintesi in corso.
+        Un buffer eliminato resta come errore per altri ttl secondi, così una richiesta
+        in ritardo della stessa risposta non crea un nuovo buffer senza l'inizio dell'audio.
+        """
+        now = time()
+        for key, buffer in list(self.buffers.items()):
+            if now - buffer.last_access <= self.ttl or buffer.in_flight:
+                continue
+            if buffer.closed:
+                del self.buffers[key]
+            else:
+                buffer.fail("Buffer eliminato per inattività")
+                buffer.touch()
+                print(f"\33[1;33m[BUFFER MANAGER]\33[0m Buffer {key} eliminato per inattività")
 
-    async def clear(self):
-        """Resetta il buffer."""
+    async def enforce_memory_cap(self, keep: AudioBuffer):
+        """Elimina i buffer meno recenti finché la memoria totale non rientra nel limite."""
         async with self.lock:
-            self.texts = []
-            self.fragments = []
+            total = sum(b.nbytes for b in self.buffers.values())
+            for key in list(self.buffers):
+                if total <= self.max_bytes:
+                    break
+                buffer = self.buffers[key]
+                if buffer is keep or buffer.closed:
+                    continue
+                total -= buffer.nbytes
+                buffer.fail("Buffer eliminato per limite di memoria") # la risposta fallisce in modo esplicito
+                print(f"\33[1;33m[BUFFER MANAGER]\33[0m Buffer {key} eliminato per limite di memoria")
+            if total > self.max_bytes:
+                print(f"\33[1;33m[BUFFER MANAGER]\33[0m Limite di memoria superato dal buffer {keep.key}")
 
 class AudioMaker:
-    """Gestisce la generazione di audio con TTS."""
-    def __init__(self, config, buffer: AudioBuffer):
+    """
+    Gestisce la generazione di audio con TTS. Il modello è condiviso da tutte le sessioni.
+    torch e Coqui TTS vengono importati solo qui, così il server risponde subito mentre il modello si carica.
+    """
+    def __init__(self, config):
+        from TTS.api import TTS
         self.config = config
-        self.tts = TTS(model_name=self.config["tts_model"]).to("cuda")
-        self.buffer = buffer
-        print("\33[1;34m[AUDIO MAKER]\33[0m Audio maker initialized")
+        self.device = self.get_device()
+        self.tts = TTS(model_name=self.config["tts_model"]).to(self.device)
+        self.sample_rate = self.tts.synthesizer.output_sample_rate
+        if self.device == "cpu" and self.config["tts_cpu"]["quantize"]:
+            self.quantize()
+        self.speaker = self.config["speakers"][self.config["speaker_index"]]
+        self.cache = None
+        if self.config["tts_cache"]["enabled"]:
+            self.cache = AudioCache(
+                path=self.config["tts_cache"]["path"],
+                max_memory_bytes=self.config["tts_cache"]["memory_mb"] * 1024 * 1024,
+                max_disk_bytes=self.config["tts_cache"]["disk_mb"] * 1024 * 1024,
+                sample_rate=self.sample_rate
+            )
+        print(f"\33[1;34m[AUDIO MAKER]\33[0m Audio maker initialized on {self.device}")
+
+    def get_device(self) -> str:
+        """Sceglie il dispositivo di inferenza e configura i thread su CPU."""
+        import torch
+        device = self.config["tts_device"]
+        if device == "auto":
+            device = "cuda" if torch.cuda.is_available() else "cpu"
+        if device == "cpu":
+            threads = self.config["tts_cpu"]["threads"] or os.cpu_count()
+            torch.set_num_threads(threads)
+            print(f"\33[1;34m[AUDIO MAKER]\33[0m Inferenza su CPU con {threads} thread")
+        return device
+
+    def quantize(self):
+        """Quantizzazione dinamica int8 dei layer lineari del modello."""
+        import torch
+        model = self.tts.synthesizer.tts_model
+        torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+        print("\33[1;34m[AUDIO MAKER]\33[0m Modello quantizzato (int8 dinamico)")
+
+    def warmup(self):
+        """Esegue una sintesi a vuoto per inizializzare kernel e cache del modello."""
+        start = time()
+        self.infer(self.config["tts_warmup"])
+        print(f"\33[1;34m[AUDIO MAKER]\33[0m Warm-up completato in {time() - start:.2f}s")
 
     def split_text_into_chunks(self, text, max_tokens, encoding="cl100k_base"):
         """Divide il testo in segmenti rispettando il limite massimo di token."""
+        import tiktoken
         tokenizer = tiktoken.get_encoding(encoding)
         tokens = tokenizer.encode(text)
-        
+
         chunks = []
         for i in range(0, len(tokens), max_tokens):
             chunk_tokens = tokens[i:i + max_tokens]
             chunks.append(tokenizer.decode(chunk_tokens))
         return chunks
 
-    async def generate_audio_fragment(self, text: str, id: int):
+    def synthesize(self, text: str) -> np.ndarray:
+        """Sintetizza un testo, consultando prima la cache."""
+        key = None
+        if self.cache:
+            key = self.cache.key(text, self.config["tts_model"], self.speaker, self.config["tts_language"], self.config["tts_speed"])
+            audio = self.cache.get(key)
+            if audio is not None:
+                return audio
+        audio = self.infer(text)
+        if self.cache:
+            self.cache.put(key, audio)
+        return audio
+
+    def infer(self, text: str) -> np.ndarray:
+        """Esegue il modello TTS senza passare dalla cache."""
+        import torch
+        with torch.inference_mode():
+            return np.asarray(self.tts.tts(
+                text=text,
+                language=self.config["tts_language"],
+                speaker=self.speaker,
+                speed=self.config["tts_speed"]
+            ), dtype=np.float32)
+
+    async def generate_audio_fragment(self, buffer: AudioBuffer, text: str, id: int):
         """Genera frammenti audio gestendo il limite massimo di token."""
         max_tokens = 400 # Limite massimo di token per frammento
         text_chunks = self.split_text_into_chunks(text, max_tokens)
 
-        for index, chunk in enumerate(text_chunks):
-            fragment = await asyncio.to_thread( # TODO: gestire la memoria della GPU
-                self.tts.tts,
-                text=chunk,
-                language="it",
-                speaker=self.config["speakers"][self.config["speaker_index"]],
-                speed=2.0
-            )
-            audio_fragment = AudioFragment(content=fragment, id=id)
-            await self.buffer.add_fragment(audio_fragment)
-            print(f"\33[1;34m[AUDIO MAKER]\33[0m Generated fragment for ID {id}-{index}")
-
-    async def save_audio(self, path: str):
-        """Salva l'audio concatenato in un file."""
-        audio = await self.buffer.get_audio()
-        sf.write(path, audio, 22050, format="WAV")
-        await self.buffer.clear()
-        print("\33[1;34m[AUDIO MAKER]\33[0m Audio saved at", path)
+        try:
+            parts = []
+            for index, chunk in enumerate(text_chunks):
+                part = await asyncio.to_thread(self.synthesize, chunk) # TODO: gestire la memoria della GPU
+                parts.append(part)
+                print(f"\33[1;34m[AUDIO MAKER]\33[0m Generated fragment for {buffer.key} ID {id}-{index}")
+            audio_fragment = AudioFragment(content=np.concatenate(parts) if len(parts) > 1 else parts[0], id=id)
+            await buffer.add_fragment(audio_fragment)
+            await buffers.enforce_memory_cap(buffer)
+        except Exception as e:
+            print("\33[1;31m[AUDIO MAKER]\33[0m Error:", e)
+            buffer.error = str(e)
+        finally:
+            buffer.in_flight -= 1
 
 @app.post("/")
 async def stream(text: TextRequest, background_tasks: BackgroundTasks):
     """Riceve un testo e avvia la generazione del frammento audio."""
+    if maker is None:
+        return not_ready()
     try:
+        buffer = await buffers.get(text.session, text.response)
+        if buffer.error:
+            return {"status": "error", "message": buffer.error}
         await buffer.add_text(text.text, text.id)  # Aggiungi il testo al buffer
-        background_tasks.add_task(maker.generate_audio_fragment, text.text, text.id)  # Genera frammento in background
+        buffer.in_flight += 1
+        background_tasks.add_task(maker.generate_audio_fragment, buffer, text.text, text.id)  # Genera frammento in background
         return {"status": "processing"}
     except Exception as e:
         print("\33[1;31m[AUDIO MAKER]\33[0m Error:", e)
         return {"status": "error", "message": str(e)}
 
 @app.get("/")
-async def save_audio_file():
-    """Controlla se l'audio è completo e lo salva."""
+async def save_audio_file(session: str = "default", response: int = 0):
+    """Controlla se l'audio della risposta è completo e lo salva."""
+    if maker is None:
+        return not_ready()
     try:
+        buffer = await buffers.get(session, response, create=False)
+        if buffer is None:
+            return {"status": "error", "message": f"Nessun buffer per {session}:{response}"}
+        if buffer.error:
+            await buffers.remove(buffer)
+            return {"status": "error", "message": buffer.error}
         if await buffer.is_complete():
-            await maker.save_audio("tmp.wav")
-            return {"status": "ok"}
+            path = await buffer.finalize()
+            await buffers.remove(buffer)
+            print("\33[1;34m[AUDIO MAKER]\33[0m Audio saved at", path)
+            return {"status": "ok", "path": path}
         else:
             return {"status": "processing"}
     except Exception as e:
         print("\33[1;31m[AUDIO MAKER]\33[0m Error:", e)
         return {"status": "error", "message": str(e)}
-    
+
+def not_ready() -> dict:
+    """Risposta delle richieste arrivate prima del caricamento del modello."""
+    if load_error is not None and not maker_lock.locked():
+        return {"status": "error", "message": load_error}
+    return {"status": "loading"}
+
+@app.get("/cache")
+def cache_stats():
+    """Statistiche della cache audio."""
+    if maker is None or maker.cache is None:
+        return {"status": "disabled"}
+    return {"status": "ok", **maker.cache.stats()}
+
+def load_maker():
+    """Carica e scalda il modello una sola volta per processo."""
+    global config, buffers, maker, load_error
+    with maker_lock:
+        if maker is not None:
+            return
+        try:
+            config = load_config()
+            new_maker = AudioMaker(config)
+            new_maker.warmup()
+            buffers = BufferManager(
+                ttl=config["tts_buffer_ttl"],
+                max_bytes=config["tts_memory_cap_mb"] * 1024 * 1024,
+                output_dir=config["tts_output_dir"],
+                output_format=config["tts_output_format"],
+                sample_rate=new_maker.sample_rate
+            )
+            maker = new_maker
+            load_error = None
+        except Exception as e:
+            print("\33[1;31m[AUDIO MAKER]\33[0m Error:", e)
+            load_error = str(e)
+
 @app.get("/start")
 def start():
-    global config, buffer, maker
-    try:
-        config = load_config()
-        buffer = AudioBuffer()
-        maker = AudioMaker(config, buffer)
+    if maker is not None:
         return {"status": "ready"}
-    except Exception as e:
-        print("\33[1;31m[AUDIO MAKER]\33[0m Error:", e)
-        return {"status": "error", "message": str(e)}
+    if maker_lock.locked():
+        return {"status": "loading"}
+    load_maker()  # riprova se il caricamento all'avvio è fallito
+    if maker is not None:
+        return {"status": "ready"}
+    return {"status": "error", "message": load_error}
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -0,0 +1,61 @@
+from utilities import load_config
+from tts import AudioMaker
+from time import time
+import argparse
+
+SENTENCES = {
+    "breve": "Prego, non c'è di che.",
+    "media": "L'Accademia Aeronautica forma gli ufficiali dell'Aeronautica Militare attraverso un percorso universitario e militare.",
+    "lunga": (
+        "Il concorso per l'ammissione ai corsi regolari dell'Accademia Aeronautica prevede prove scritte, "
+        "accertamenti psicofisici e attitudinali, una prova di efficienza fisica e un tirocinio, "
+        "al termine dei quali viene stilata la graduatoria finale di merito dei candidati."
+    )
+}
+
+def benchmark(maker: AudioMaker, repeat: int) -> None:
+    """
+    Print the real-time factor (synthesis time / audio duration) per sentence length
+
+    Args:
+        maker (AudioMaker): Initialized audio maker
+        repeat (int): Number of runs per sentence
+    """
+    sample_rate = maker.sample_rate
+    print(f"{'Frase':<8}{'Caratteri':>10}{'Audio (s)':>12}{'Sintesi (s)':>14}{'RTF':>8}")
+    for label, text in SENTENCES.items():
+        elapsed = 0
+        duration = 0
+        for _ in range(repeat):
+            start = time()
+            audio = maker.infer(text)
+            elapsed += time() - start
+            duration += len(audio) / sample_rate
+        rtf = f"{elapsed / duration:.2f}" if duration else "n/a" # frase sintetizzata senza audio
+        print(f"{label:<8}{len(text):>10}{duration / repeat:>12.2f}{elapsed / repeat:>14.2f}{rtf:>8}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark della sintesi vocale")
+    parser.add_argument("--device", choices=["auto", "cuda", "cpu"], help="Sovrascrive tts_device")
+    parser.add_argument("--threads", type=int, help="Sovrascrive tts_cpu.threads")
+    parser.add_argument("--quantize", action="store_true", help="Abilita la quantizzazione int8")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    config = load_config()
+    config["tts_cache"]["enabled"] = False
+    if args.device:
+        config["tts_device"] = args.device
+    if args.threads is not None:
+        config["tts_cpu"]["threads"] = args.threads
+    if args.quantize:
+        config["tts_cpu"]["quantize"] = True
+
+    start = time()
+    maker = AudioMaker(config)
+    print(f"\33[1;34m[BENCHMARK]\33[0m Modello caricato in {time() - start:.2f}s")
+    maker.warmup()
+    benchmark(maker, args.repeat)
+
+if __name__ == "__main__":
+    main()
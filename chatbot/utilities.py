@@ -1,8 +1,7 @@
-from sklearn.metrics.pairwise import cosine_similarity
-from sklearn.feature_extraction.text import TfidfVectorizer
 from langchain_core.messages import HumanMessage, AIMessage
 
 from time import time
+from uuid import uuid4
 import yaml
 
 import asyncio
@@ -14,6 +13,8 @@ from pydantic import BaseModel
 class TextRequest(BaseModel):
     text: str
     id: int
+    session: str = "default"
+    response: int = 0
 
 ###  Messages ###
 
@@ -57,6 +58,7 @@ class ChatHistory():
         self.limit_history()
 
     def train_vectorizer(self):
+        from sklearn.feature_extraction.text import TfidfVectorizer # scikit-learn solo al primo follow-up
         all_texts = []
         ai_messagges = [msg for msg in self.messages if isinstance(msg.message, AIMessage)]
         for msg in ai_messagges:
@@ -67,6 +69,7 @@ class ChatHistory():
     def get_old_messages_ctx(self, threshold: float):
         if not self.vectorizer:
             return []
+        from sklearn.metrics.pairwise import cosine_similarity
         user_message_vector = self.messages[-1].embed_self(self.vectorizer)
         ctx = []
         ai_messagges = [msg for msg in self.messages if isinstance(msg.message, AIMessage)]
@@ -106,18 +109,78 @@ class ChatHistory():
             n = len(self.messages)
         return [msg.message for msg in self.messages[-n:]]
 
+    def forget_documents(self):
+        for msg in self.messages:
+            msg.documents = []
+        self.vectorizer = None
+
     def clear(self):
         self.messages = []
         self.vectorizer = None
 
 ### Handler ###
 
+class RenderCoalescer:
+    """
+    Renders the streamed text into a container at most once per frame interval,
+    independently of how fast tokens arrive
+    """
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.container = None
+        self.text = ""
+        self.dirty = False
+        self.task = None
+
+    def start(self, container=None):
+        self.cancel()
+        self.container = container
+        self.text = ""
+        self.dirty = False
+        if self.container is not None and self.interval > 0:
+            try:
+                self.task = asyncio.get_running_loop().create_task(self.loop())
+            except RuntimeError: # nessun event loop: si renderizza solo alla fine
+                self.task = None
+
+    def update(self, text: str):
+        self.text = text
+        self.dirty = True
+        if self.interval <= 0:
+            self.flush()
+
+    async def loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            self.flush()
+
+    def flush(self):
+        if self.dirty and self.container is not None:
+            self.container.markdown(self.text)
+            self.dirty = False
+
+    def cancel(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    async def stop(self):
+        """Stops the frame loop and renders whatever is left"""
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        self.flush()
+
 
 class StdOutHandler:
     """
     Class to manage token's stream
     """
-    def __init__(self, config, debug=False):
+    def __init__(self, config, debug=False, tts=None):
         self.containers = None
         self.text = ""
         self.chunks = []
@@ -126,13 +189,22 @@ class StdOutHandler:
         self.config = config
         self.debug = debug
         self.lock = asyncio.Lock()
+        self.session_id = uuid4().hex # identifica la sessione presso il server TTS
+        self.response_id = 0
+        self.audio_path = None
+        self.renderer = RenderCoalescer(config.get('render_interval', 0))
+        self.tts = tts # stato del server TTS, None se si assume sempre pronto
+        self.audio = True
 
     def start(self, containers=None):
         self.time = time()
+        self.response_id += 1
+        self.audio = self.tts is None or self.tts.ready # deciso per l'intera risposta, così l'audio non resta incompleto
         self.text = ""
         self.containers = containers
         self.chunks = []
         self.completed_chunks = []
+        self.renderer.start(containers[0] if containers else None)
 
     async def on_new_token(self, token: dict) -> None:
         token = token.get('answer', None)
@@ -147,8 +219,7 @@ class StdOutHandler:
             except Exception as e:
                 print("\33[1;31m[STDOUTHANDLER]\33[0m: Errore durante la generazione dell'audio")
                 self.error(e)
-            if self.containers:
-                self.containers[0].markdown(self.text)
+            self.renderer.update(self.text)
     
     def sanitize_text(self, text: str) -> str:
         return text.translate({ord(i): None for i in "*\n\t"})
@@ -157,7 +228,15 @@ class StdOutHandler:
         stripped_text = self.sanitize_text(text)
         return [chunk.strip() for chunk in stripped_text.split(".") if chunk.strip()]
 
+    def text_request(self, text: str, id: int) -> TextRequest:
+        return TextRequest(text=text, id=id, session=self.session_id, response=self.response_id)
+
+    def audio_params(self) -> dict:
+        return {"session": self.session_id, "response": self.response_id}
+
     async def generate_audio_stream(self):
+        if not self.audio:
+            return
         async with self.lock:
             if self.text:
                 self.chunks = self.chunk_text(self.text)
@@ -169,13 +248,18 @@ class StdOutHandler:
                         if self.chunks[i] and i not in self.completed_chunks:
                             self.completed_chunks.append(i)
                             response = await client.post(
-                                "http://localhost:8000/",
-                                json=TextRequest(text=self.chunks[i], id=i).model_dump()
+                                f"{self.config['tts_url']}/",
+                                json=self.text_request(self.chunks[i], i).model_dump()
                             )
-                            if response.json().get("status", 'error') == 'error':
+                            status = response.json().get("status", 'error')
+                            if status == 'loading':
+                                self.audio_unavailable()
+                                return
+                            if status == 'error':
                                 self.error(Exception("Errore nell'invio del chunk"))
 
     async def end(self):
+        await self.renderer.stop()
         async with self.lock:
             self.time = time() - self.time
             text_time = f"⏱ Tempo di risposta: {self.time:.2f} secondi"
@@ -183,33 +267,46 @@ class StdOutHandler:
                 print(text_time)
             if self.containers:
                 self.containers[1].markdown(text_time)
-            if self.text:
+            if self.text and self.audio:
                 self.chunks = self.chunk_text(self.text)
                 if self.chunks:
                     async with httpx.AsyncClient() as client:
                         response = await client.post(
-                            "http://localhost:8000/",
-                            json=TextRequest(text=self.chunks[-1], id=len(self.chunks) - 1).model_dump()
+                            f"{self.config['tts_url']}/",
+                            json=self.text_request(self.chunks[-1], len(self.chunks) - 1).model_dump()
                         )
-                        if response.json().get("status", 'error') == 'error':
-                            self.error(Exception("Errore nell'invio del chunk"))
-
-                        # Controllo finale per il completamento
-                        final_response = await client.get("http://localhost:8000/")
-                        while final_response.json().get("status", 'error') == 'processing':
-                            print("Risposta finale in elaborazione")
-                            await asyncio.sleep(1)
-                            final_response = await client.get("http://localhost:8000/")
-                        if final_response.json().get("status", 'error') == 'ok':
-                            print("Risposta finale ricevuta")
-                        elif final_response.json().get("status", 'error') == 'error':
-                            print("Errore nella risposta finale")
-                            self.error(Exception("Errore nella risposta finale"))
+                        status = response.json().get("status", 'error')
+                        if status == 'loading':
+                            self.audio_unavailable()
+                        else:
+                            if status == 'error':
+                                self.error(Exception("Errore nell'invio del chunk"))
+
+                            # Controllo finale per il completamento
+                            final_response = await client.get(f"{self.config['tts_url']}/", params=self.audio_params())
+                            while final_response.json().get("status", 'error') == 'processing':
+                                print("Risposta finale in elaborazione")
+                                await asyncio.sleep(1)
+                                final_response = await client.get(f"{self.config['tts_url']}/", params=self.audio_params())
+                            if final_response.json().get("status", 'error') == 'ok':
+                                self.audio_path = final_response.json().get("path")
+                                print("Risposta finale ricevuta")
+                            elif final_response.json().get("status", 'error') == 'error':
+                                print("Errore nella risposta finale")
+                                self.error(Exception("Errore nella risposta finale"))
             self.text = ""
             self.chunks = []
             self.completed_chunks = []
 
+    def audio_unavailable(self):
+        """
+        The TTS model is still loading: the response goes on without audio
+        """
+        print("\33[1;33m[STDOUTHANDLER]\33[0m: TTS in caricamento, risposta senza audio")
+        self.audio = False
+
     def error(self, error: Exception):
+        self.renderer.cancel()
         self.text = ""
         self.chunks = []
         self.completed_chunks = []
@@ -0,0 +1,97 @@
+from langchain_community.vectorstores import FAISS
+import numpy as np
+import faiss
+import json
+import os
+
+COMPRESSED_INDEX = "index.compressed.faiss"
+COMPRESSION_FILE = "compression.json"
+METHODS = ("none", "fp16", "sq8", "pq", "pca", "truncate")
+TRAIN_SIZE = 100_000 # vettori usati per addestrare quantizzatori e PCA
+
+def read_mapped(path: str) -> faiss.Index:
+    """
+    Read a flat index mapped from disk, as the chatbot does for re-scoring: only the vectors
+    that are used are loaded. IO_FLAG_MMAP maps only inverted lists, a flat index needs IO_FLAG_MMAP_IFC
+    """
+    return faiss.read_index(path, getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP))
+
+def vectors(index: faiss.Index) -> np.ndarray:
+    return index.reconstruct_n(0, index.ntotal)
+
+def build_index(vectors: np.ndarray, method: str, dimensions: int = 256, pq_subquantizers: int = 64, pq_bits: int = 8) -> faiss.Index:
+    """
+    Build a compressed copy of a set of float32 vectors
+
+    Args:
+        vectors (np.ndarray): Vectors, in the order of the flat index
+        method (str): fp16, sq8, pq, pca or truncate
+        dimensions (int): Dimensions kept by pca and truncate
+        pq_subquantizers (int): Sub-vectors of pq, must divide the dimension of the vectors
+        pq_bits (int): Bits of every pq code
+
+    Returns:
+        faiss.Index: The compressed index, with the same positions of the flat one
+    """
+    d = vectors.shape[1]
+    dimensions = min(dimensions, d)
+    if method == "fp16":
+        index = faiss.index_factory(d, "SQfp16")
+    elif method == "sq8":
+        index = faiss.index_factory(d, "SQ8")
+    elif method == "pq":
+        if d % pq_subquantizers:
+            raise ValueError(f"pq_subquantizers ({pq_subquantizers}) deve dividere la dimensione dei vettori ({d})")
+        # ogni centroide richiede almeno 39 vettori di addestramento
+        bits = max(1, min(pq_bits, int(np.log2(max(len(vectors), 2) / 39))))
+        index = faiss.index_factory(d, f"PQ{pq_subquantizers}x{bits}")
+    elif method == "pca":
+        index = faiss.index_factory(d, f"PCA{dimensions},Flat")
+    elif method == "truncate":
+        index = faiss.IndexPreTransform(faiss.RemapDimensionsTransform(d, dimensions, False), faiss.IndexFlatL2(dimensions))
+    else:
+        raise ValueError(f"Metodo di compressione sconosciuto: {method}")
+
+    if not index.is_trained:
+        sample = vectors
+        if len(vectors) > TRAIN_SIZE:
+            sample = vectors[np.random.default_rng(0).choice(len(vectors), TRAIN_SIZE, replace=False)]
+        index.train(sample)
+    index.add(vectors)
+    return index
+
+def compress(config: dict, vectorstore: FAISS, path: str) -> None:
+    """
+    Save a compressed copy of the index next to the flat one, or remove the
+    copy of a previous build if compression is disabled.
+    The flat float32 index stays on disk for re-scoring.
+
+    Args:
+        config (dict): Configuration
+        vectorstore (FAISS): Vectorstore with the flat index
+        path (str): Directory of the saved vectorstore
+    """
+    options = config['compression']
+    index_path = os.path.join(path, COMPRESSED_INDEX)
+    info_path = os.path.join(path, COMPRESSION_FILE)
+    if options['method'] == "none" or vectorstore.index.ntotal == 0:
+        for f in (index_path, info_path):
+            if os.path.exists(f):
+                os.remove(f)
+        return
+
+    index = build_index(
+        vectors(vectorstore.index),
+        options['method'],
+        dimensions=options['dimensions'],
+        pq_subquantizers=options['pq_subquantizers'],
+        pq_bits=options['pq_bits']
+    )
+    faiss.write_index(index, index_path + ".tmp")
+    os.replace(index_path + ".tmp", index_path)
+    with open(info_path, "w", encoding="utf-8") as file:
+        json.dump({"method": options['method'], "ntotal": index.ntotal, "dimension": vectorstore.index.d}, file, indent=2)
+
+    flat_size = os.path.getsize(os.path.join(path, "index.faiss"))
+    compressed_size = os.path.getsize(index_path)
+    print(f"\33[1;32m[Compression]\33[0m: Indice {options['method']} salvato: {compressed_size / 2**20:.1f} MB invece di {flat_size / 2**20:.1f} MB")
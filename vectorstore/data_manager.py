@@ -1,5 +1,5 @@
 from enum import Enum
-import requests
+from web_fetcher import WebFetcher
 import os
 
 ### Data types ###
@@ -9,6 +9,7 @@ class DataType(Enum):
     WEB = 2
     PDF = 3
     CSV = 4
+    DOCX = 5
 
 ### Data class ###
 
@@ -19,6 +20,7 @@ class Data():
         self.chunk_size = chunk_size
         self.chunk_overlap = chunk_overlap
         self.extra = extra
+        self.content = None # contenuto delle pagine web, scaricato durante la validazione
     
     def __eq__(self, value: object) -> bool:
         if not isinstance(value, Data):
@@ -43,6 +45,12 @@ class DataList():
         self.data = []
         self.config = config
         self.main_dir = config['paths']['data']
+        self.fetcher = WebFetcher(
+            cache_dir=config['paths']['cache'] + "http/",
+            threads=config['ingestion']['web_threads'],
+            min_interval=config['web']['min_interval'],
+            timeout=config['web']['timeout']
+        )
     
     def get_data_type(self, path) -> DataType:
         """
@@ -60,6 +68,8 @@ class DataList():
             return DataType.PDF
         if path.endswith(".csv"):
             return DataType.CSV
+        if path.endswith(".docx"):
+            return DataType.DOCX
         if path.startswith("http"):
             return DataType.WEB
         return None
@@ -87,7 +97,8 @@ class DataList():
     
     def test(self) -> bool:
         """
-        Check if data is valid
+        Check if data is valid.
+        Web pages are downloaded concurrently here and their content is kept for the Splitter.
 
         Returns:
             bool: True if data is valid, False otherwise
@@ -96,16 +107,13 @@ class DataList():
             print("\33[1;31m[DataTester]\33[0m: Nessun dato presente")
             return False
         for d in self.data:
-            if d.data_type == DataType.TEXT or d.data_type == DataType.PDF or d.data_type == DataType.CSV:
+            if d.data_type in (DataType.TEXT, DataType.PDF, DataType.CSV, DataType.DOCX):
                 path = self.main_dir + d.path
                 if not os.path.exists(path):
                     print(f"\33[1;31m[DataTester]\33[0m: Il file {d.path} non esiste")
                     return False
                 
             if d.data_type == DataType.WEB:
-                if requests.head(d.path).status_code != 200:
-                    print(f"\33[1;31m[DataTester]\33[0m: Il sito {d.path} non è raggiungibile")
-                    return False
                 if not d.path.startswith("http"):
                     print(f"\33[1;31m[DataTester]\33[0m: Il path {d.path} non è un URL valido")
                     return False
@@ -116,6 +124,15 @@ class DataList():
             if d.data_type == DataType.CSV and d.extra == "None":
                 print(f"\33[1;31m[DataTester]\33[0m: Il campo extra per il file {d.path} è vuoto")
                 return False
+        
+        web = [d for d in self.data if d.data_type == DataType.WEB]
+        pages = self.fetcher.fetch_all([d.path for d in web])
+        for d in web:
+            page = pages[d.path]
+            if not page.ok:
+                print(f"\33[1;31m[DataTester]\33[0m: Il sito {d.path} non è raggiungibile: {page.error}")
+                return False
+            d.content = page.content
             
         print("\33[1;32m[DataTester]\33[0m: Dati validati con successo")
         return True
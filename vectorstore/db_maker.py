@@ -1,6 +1,17 @@
 from data_manager import Data
 from splitter import Splitter
+from manifest import Manifest
+from embedding import EmbeddingStage
+from dedup import Deduplicator
+from concurrent.futures import ProcessPoolExecutor
+import sharding
+import compression
+import lexical
+import shutil
+import os
 from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+from typing import Iterable
 from tqdm import tqdm
 
 class DBMaker():
@@ -11,35 +22,196 @@ class DBMaker():
         self.config = config
         self.vectorstore = vectorstore
         print("\33[1;34m[DBMaker]\33[0m: Maker del database inizializzato")
-    
+
+    def splitter(self) -> Splitter:
+        return Splitter(
+            self.config['paths']['data'],
+            workers=self.config['ingestion']['workers'],
+            web_threads=self.config['ingestion']['web_threads'],
+            cache_dir=self.config['paths']['cache']
+        )
+
     def make(self, data: list[Data]):
         """
         Create the database.
         """
-        splitter = Splitter(self.config['paths']['data'])
-        docs = splitter.create_chunks(data)
-        batches = self.batch(docs)
-        for batch in tqdm(batches, desc="Caricamento documenti..."):
-            self.vectorstore.add_documents(batch)
-        self.vectorstore.save_local(self.config['paths']['db'])
-    
-    def batch(self, chunks, n_max=10000):
-        batches = []
-        current_batch = []
-        count = 0
-
-        for c in chunks:
-            chunk_length = len(c.page_content)
-            
-            if count + chunk_length >= n_max:
-                batches.append(current_batch)
-                current_batch = [c]
-                count = chunk_length
+        manifest = Manifest(self.config['paths']['db'], self.config['paths']['data'])
+        _, _, fingerprints = manifest.diff(data)
+        splitter = self.splitter()
+        stage = self.embedding_stage()
+        docs = splitter.iter_chunks(data)
+        deduplicator = None
+        if self.config['dedup']['enabled']:
+            deduplicator = Deduplicator(threshold=self.config['dedup']['threshold'])
+            docs = deduplicator.filter(docs)
+        self.add(docs, stage)
+        if deduplicator:
+            self.merge_sources(deduplicator)
+        failed = {path for path, _ in splitter.errors}
+        for path, ids in splitter.source_ids.items():
+            manifest.record(path, fingerprints[path], ids, complete=path not in failed)
+        self.save()
+        manifest.save()
+        stage.clear()
+
+    def make_sharded(self, data: list[Data]):
+        """
+        Create the database splitting the sources into shards built in parallel by worker processes.
+        The shards are merged into a single index, or kept separate if build.merge_shards is false.
+        Chunk ids are the same a non-sharded build would assign.
+        """
+        db_path = self.config['paths']['db']
+        manifest = Manifest(db_path, self.config['paths']['data'])
+        _, _, fingerprints = manifest.diff(data)
+        if self.config['dedup']['enabled']:
+            print("\33[1;33m[DBMaker]\33[0m: Deduplicazione non applicata alla build a shard, serve una build con shards: 1")
+        parts = sharding.partition(self.config, data, self.config['build']['shards'])
+        print(f"\33[1;34m[DBMaker]\33[0m: Costruzione di {len(parts)} shard in parallelo")
+
+        with ProcessPoolExecutor(max_workers=len(parts)) as executor:
+            futures = [
+                executor.submit(sharding.build_shard, self.config, shard, [data[i] for i in part], self.vectorstore.index.d)
+                for shard, part in enumerate(parts)
+            ]
+            results = [future.result() for future in futures]
+        failed = set()
+        for _, _, errors in results:
+            for path, error in errors:
+                print(f"\33[1;31m[DBMaker]\33[0m: Sorgente {path} ignorata: {error}")
+                failed.add(path)
+
+        mapping, source_ids = sharding.global_ids(data, [(part, ids) for part, (_, ids, _) in zip(parts, results)])
+        names, shard_stores = [], []
+        for shard, (path, _, _) in enumerate(results):
+            shard_store = FAISS.load_local(path, embeddings=self.vectorstore.embedding_function, allow_dangerous_deserialization=True)
+            sharding.remap(shard_store, shard, mapping)
+            if self.config['build']['merge_shards']:
+                self.vectorstore.merge_from(shard_store)
+                shutil.rmtree(path)
             else:
-                current_batch.append(c)
-                count += chunk_length
+                shard_store.save_local(path)
+                compression.compress(self.config, shard_store, path)
+                names.append(os.path.basename(path))
+                shard_stores.append(shard_store)
+
+        for path, ids in source_ids.items():
+            manifest.record(path, fingerprints[path], ids, complete=path not in failed)
+        if self.config['build']['merge_shards']:
+            self.save()
+        else:
+            lexical.save(self.config, shard_stores, db_path) # un solo indice per tutti gli shard
+            sharding.save_shards_file(db_path, names)
+        manifest.save()
+        print(f"\33[1;32m[DBMaker]\33[0m: {len(mapping)} chunks in {len(parts)} shard")
 
-        if current_batch:
-            batches.append(current_batch)
-        
-        return batches
\ No newline at end of file
+    def dependents(self, manifest: Manifest, changed: list[Data], removed: list[str], data: list[Data]) -> list[Data]:
+        """
+        Sources whose chunks were dropped as duplicates of chunks that are going to be deleted:
+        they must be processed again, otherwise their content would be lost
+        """
+        paths = {d.path for d in changed}
+        sources = set()
+        for path in removed + list(paths):
+            for id in manifest.ids(path):
+                doc = self.vectorstore.docstore.search(str(id))
+                if isinstance(doc, Document):
+                    sources.update(doc.metadata.get("sources", []))
+        return [
+            d for d in data
+            if d.path not in paths and (d.path in sources or self.config['paths']['data'] + d.path in sources)
+        ]
+
+    def merge_sources(self, deduplicator: Deduplicator):
+        """
+        Store in the canonical chunks the sources of their removed duplicates
+        """
+        for id in deduplicator.duplicates:
+            doc = self.vectorstore.docstore.search(str(id))
+            doc.metadata["sources"] = deduplicator.sources(doc)
+
+    def save(self):
+        """
+        Save the database as a single index, with its compressed copy and its lexical index if enabled
+        """
+        db_path = self.config['paths']['db']
+        self.vectorstore.save_local(db_path)
+        compression.compress(self.config, self.vectorstore, db_path)
+        lexical.save(self.config, [self.vectorstore], db_path)
+        shards_file = os.path.join(db_path, sharding.SHARDS_FILE)
+        if os.path.exists(shards_file): # una build precedente aveva shard separati
+            os.remove(shards_file)
+
+    def update(self, data: list[Data], diff: tuple[list[Data], list[str], dict] | None = None):
+        """
+        Update the database, processing only the sources added or changed since the last build
+        and removing the vectors of the deleted ones.
+
+        Args:
+            data (list[Data]): List of data
+            diff (tuple | None): Result of Manifest.diff for this database, if already computed
+        """
+        manifest = Manifest.load(self.config['paths']['db'], self.config['paths']['data'])
+        changed, removed, fingerprints = diff or manifest.diff(data)
+        changed = list(changed)
+        changed += self.dependents(manifest, changed, removed, data)
+        print(f"\33[1;34m[DBMaker]\33[0m: {len(changed)} sorgenti nuove o modificate, {len(removed)} rimosse, {len(data) - len(changed)} invariate")
+
+        if self.config['dedup']['enabled']:
+            print("\33[1;33m[DBMaker]\33[0m: Deduplicazione non applicata all'aggiornamento incrementale, serve una build completa")
+
+        splitter = self.splitter()
+        stage = self.embedding_stage()
+        added = self.add(splitter.iter_chunks(changed, start_id=manifest.next_id), stage)
+
+        # I nuovi chunk hanno id diversi dai vecchi, quindi si possono eliminare dopo l'aggiunta.
+        # Le sorgenti fallite mantengono i vettori della build precedente e perdono i chunk parziali
+        failed = {path for path, _ in splitter.errors}
+        reverted = {path for path in failed if manifest.ids(path)}
+        stale = [i for path in removed for i in manifest.ids(path)]
+        for path, ids in splitter.source_ids.items():
+            stale += ids if path in reverted else manifest.ids(path)
+        existing = set(self.vectorstore.index_to_docstore_id.values()) # i duplicati eliminati non hanno vettori
+        stale = [i for i in stale if str(i) in existing]
+        if stale:
+            self.vectorstore.delete([str(i) for i in stale])
+
+        for path in removed:
+            manifest.remove(path)
+        for path, ids in splitter.source_ids.items():
+            if path in reverted:
+                ids = manifest.ids(path)
+                print(f"\33[1;33m[DBMaker]\33[0m: {path} fallita, mantenuti i {len(ids)} chunks della build precedente")
+            manifest.record(path, fingerprints[path], ids, complete=path not in failed)
+        self.save()
+        manifest.save()
+        stage.clear()
+        print(f"\33[1;32m[DBMaker]\33[0m: Rimossi {len(stale)} vettori, aggiunti {added} chunks")
+
+    def embedding_stage(self) -> EmbeddingStage:
+        return EmbeddingStage(
+            self.vectorstore.embedding_function,
+            checkpoint_dir=self.config['paths']['cache'] + "checkpoints/",
+            max_tokens=self.config['embedding']['max_tokens'],
+            max_items=self.config['embedding']['max_items'],
+            concurrency=self.config['embedding']['concurrency'],
+            retries=self.config['embedding']['retries'],
+            backoff=self.config['embedding']['backoff']
+        )
+
+    def add(self, docs: Iterable[Document], stage: EmbeddingStage) -> int:
+        """
+        Embed a stream of chunks and add them to the vectorstore.
+        Only the batches in flight are kept in memory.
+
+        Returns:
+            int: Number of chunks added
+        """
+        added = 0
+        for batch, vectors in tqdm(stage.run(docs), desc="Caricamento documenti..."):
+            self.vectorstore.add_embeddings(
+                zip([d.page_content for d in batch], vectors.tolist()),
+                metadatas=[d.metadata for d in batch],
+                ids=[str(d.metadata["id"]) for d in batch]
+            )
+            added += len(batch)
+        return added
@@ -0,0 +1,127 @@
+from langchain_core.documents import Document
+from collections import defaultdict
+from typing import Iterable, Iterator
+import numpy as np
+import hashlib
+import zlib
+import re
+
+PRIME = 4294967291 # il più grande primo < 2^32: (a * x + b) non supera 2^64
+WORD = re.compile(r"\w+", re.UNICODE)
+
+class Deduplicator():
+    """
+    Remove exact and near-duplicate chunks from a stream using MinHash signatures
+    and locality sensitive hashing. Only the body of a chunk is compared, since the
+    title/source prefix differs between copies of the same passage.
+    The first occurrence is kept and the sources of its duplicates are collected.
+    The state of every kept chunk stays in memory for the whole build: its signature
+    (4 bytes per permutation), an 8 byte hash of the text and one bucket entry per band,
+    about 3 KB per chunk with the default parameters.
+    """
+    def __init__(self, threshold: float = 0.85, num_perm: int = 128, bands: int = 32, shingle_size: int = 5, seed: int = 1):
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+        rng = np.random.default_rng(seed)
+        self.a = rng.integers(1, PRIME, size=num_perm, dtype=np.uint64)
+        self.b = rng.integers(0, PRIME, size=num_perm, dtype=np.uint64)
+        self.band_mix = rng.integers(1, 2**63, size=self.rows, dtype=np.uint64) | np.uint64(1)
+        self.exact = {} # hash del testo normalizzato -> riga
+        self.buckets = [{} for _ in range(bands)] # chiave della banda -> riga, o lista di righe
+        self.signatures = np.empty((1024, num_perm), dtype=np.uint32) # valori < PRIME < 2^32
+        self.ids = [] # id del chunk di ogni riga
+        self.duplicates = defaultdict(list) # id canonico -> sorgenti dei duplicati
+        self.removed = 0
+
+    @staticmethod
+    def body(doc: Document) -> str:
+        content = doc.page_content
+        if "\\BODY: " in content:
+            content = content.split("\\BODY: ", 1)[1]
+        return content
+
+    @staticmethod
+    def source(doc: Document) -> str:
+        return doc.metadata.get("source", "")
+
+    def shingles(self, words: list[str]) -> np.ndarray:
+        if len(words) < self.shingle_size:
+            grams = [" ".join(words)]
+        else:
+            grams = [" ".join(words[i:i + self.shingle_size]) for i in range(len(words) - self.shingle_size + 1)]
+        return np.array(sorted({zlib.crc32(g.encode("utf-8")) for g in grams}), dtype=np.uint64)
+
+    def signature(self, shingles: np.ndarray) -> np.ndarray:
+        hashes = (np.outer(shingles, self.a) + self.b) % PRIME # una permutazione per colonna
+        return hashes.min(axis=0).astype(np.uint32)
+
+    def band_keys(self, signature: np.ndarray) -> list[int]:
+        """
+        One 64 bit key per band; a collision only adds a candidate, which is then checked on the whole signature
+        """
+        rows = signature.reshape(self.bands, self.rows).astype(np.uint64)
+        return (rows * self.band_mix).sum(axis=1).tolist()
+
+    def record(self, id: int, digest: int, signature: np.ndarray, keys: list[int]) -> None:
+        row = len(self.ids)
+        if row == len(self.signatures):
+            self.signatures = np.resize(self.signatures, (2 * row, self.num_perm))
+        self.signatures[row] = signature
+        self.ids.append(id)
+        self.exact[digest] = row
+        for bucket, key in zip(self.buckets, keys):
+            rows = bucket.get(key)
+            if rows is None:
+                bucket[key] = row # quasi sempre una sola riga per chiave: niente lista
+            elif isinstance(rows, list):
+                rows.append(row)
+            else:
+                bucket[key] = [rows, row]
+
+    def is_duplicate(self, doc: Document) -> bool:
+        """
+        Check a chunk against the ones already seen, recording it if it is new
+        """
+        words = WORD.findall(self.body(doc).lower())
+        normalized = " ".join(words)
+        digest = int.from_bytes(hashlib.sha1(normalized.encode("utf-8")).digest()[:8], "little")
+        canonical = self.exact.get(digest)
+        if canonical is None:
+            signature = self.signature(self.shingles(words))
+            keys = self.band_keys(signature)
+            candidates = set()
+            for bucket, key in zip(self.buckets, keys):
+                rows = bucket.get(key)
+                if isinstance(rows, list):
+                    candidates.update(rows)
+                elif rows is not None:
+                    candidates.add(rows)
+            for candidate in candidates:
+                if np.mean(self.signatures[candidate] == signature) >= self.threshold:
+                    canonical = candidate
+                    break
+            if canonical is None:
+                self.record(doc.metadata["id"], digest, signature, keys)
+                return False
+        self.duplicates[self.ids[canonical]].append(self.source(doc))
+        self.removed += 1
+        return True
+
+    def filter(self, docs: Iterable[Document]) -> Iterator[Document]:
+        """
+        Yield only the chunks that are not duplicates of a previous one
+        """
+        for doc in docs:
+            if not self.is_duplicate(doc):
+                yield doc
+        print(f"\33[1;32m[Deduplicator]\33[0m: Rimossi {self.removed} chunks duplicati")
+
+    def sources(self, canonical: Document) -> list[str]:
+        """
+        Sources of a canonical chunk, merged with those of its duplicates
+        """
+        sources = [self.source(canonical)] + self.duplicates.get(canonical.metadata["id"], [])
+        return list(dict.fromkeys(sources))
@@ -0,0 +1,122 @@
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+from itertools import islice
+from typing import Iterable, Iterator
+from time import sleep
+import numpy as np
+import hashlib
+import random
+import shutil
+import os
+
+class EmbeddingStage():
+    """
+    Embed chunks in batches bounded by tokens and items, with a bounded number of
+    concurrent requests, retries with exponential backoff and a checkpoint of every
+    completed batch, so that an interrupted build resumes where it stopped.
+    """
+    def __init__(self, embedder: Embeddings, checkpoint_dir: str, max_tokens: int, max_items: int,
+                 concurrency: int, retries: int, backoff: float):
+        self.embedder = embedder
+        self.checkpoint_dir = checkpoint_dir
+        self.max_tokens = max_tokens
+        self.max_items = max_items
+        self.concurrency = concurrency
+        self.retries = retries
+        self.backoff = backoff
+        self.resumed = 0
+        os.makedirs(self.checkpoint_dir, exist_ok=True)
+
+    @staticmethod
+    def count_tokens(text: str) -> int:
+        return len(text) // 4 + 1 # stima: circa 4 caratteri per token
+
+    def batch(self, chunks: Iterable[Document]) -> Iterator[list[Document]]:
+        """
+        Group chunks into batches respecting both the token and the item limits
+
+        Args:
+            chunks (Iterable[Document]): Stream of chunks
+
+        Yields:
+            list[Document]: Batches of chunks
+        """
+        current_batch = []
+        count = 0
+
+        for c in chunks:
+            tokens = self.count_tokens(c.page_content)
+            if current_batch and (count + tokens > self.max_tokens or len(current_batch) >= self.max_items):
+                yield current_batch
+                current_batch = []
+                count = 0
+            current_batch.append(c)
+            count += tokens
+
+        if current_batch:
+            yield current_batch
+
+    def checkpoint_path(self, batch: list[Document]) -> str:
+        digest = hashlib.sha256()
+        for d in batch:
+            digest.update(str(d.metadata.get("id")).encode("utf-8"))
+            digest.update(d.page_content.encode("utf-8"))
+        return os.path.join(self.checkpoint_dir, f"{digest.hexdigest()}.npy")
+
+    def embed_batch(self, batch: list[Document]) -> np.ndarray:
+        """
+        Embed a batch, reusing its checkpoint if present
+        """
+        path = self.checkpoint_path(batch)
+        if os.path.exists(path):
+            self.resumed += 1
+            return np.load(path)
+
+        texts = [d.page_content for d in batch]
+        for attempt in range(self.retries + 1):
+            try:
+                vectors = np.asarray(self.embedder.embed_documents(texts), dtype=np.float32)
+                break
+            except Exception as e:
+                if attempt == self.retries:
+                    raise e
+                delay = self.backoff * 2 ** attempt * (1 + random.random())
+                print(f"\33[1;33m[EmbeddingStage]\33[0m: Errore durante l'embedding ({e}), nuovo tentativo tra {delay:.1f}s")
+                sleep(delay)
+
+        np.save(path + ".tmp.npy", vectors)
+        os.replace(path + ".tmp.npy", path)
+        return vectors
+
+    def run(self, chunks: Iterable[Document]) -> Iterator[tuple[list[Document], np.ndarray]]:
+        """
+        Embed a stream of chunks. At most 2 * concurrency batches are in flight,
+        so memory does not depend on the number of chunks.
+
+        Args:
+            chunks (Iterable[Document]): Stream of chunks
+
+        Yields:
+            tuple[list[Document], np.ndarray]: Every batch with its vectors, in order
+        """
+        batches = self.batch(chunks)
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            pending = deque()
+            for batch in islice(batches, 2 * self.concurrency):
+                pending.append((batch, executor.submit(self.embed_batch, batch)))
+            while pending:
+                batch, future = pending.popleft()
+                vectors = future.result()
+                for next_batch in islice(batches, 1):
+                    pending.append((next_batch, executor.submit(self.embed_batch, next_batch)))
+                yield batch, vectors
+        if self.resumed:
+            print(f"\33[1;32m[EmbeddingStage]\33[0m: {self.resumed} batch ripresi dal checkpoint")
+
+    def clear(self) -> None:
+        """
+        Remove the checkpoints once the database has been saved
+        """
+        shutil.rmtree(self.checkpoint_dir, ignore_errors=True)
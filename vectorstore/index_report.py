@@ -0,0 +1,91 @@
+from compression import build_index, vectors, read_mapped, METHODS
+from utilities import load_config
+import versions
+from time import perf_counter
+import numpy as np
+import argparse
+import tempfile
+import faiss
+import os
+
+def search(index: faiss.Index, full_index: faiss.Index, queries: np.ndarray, k: int, rescore_factor: int) -> tuple[np.ndarray, list[float]]:
+    """
+    Search the queries one at a time, as the chatbot does, optionally re-scoring the
+    candidates with the float32 vectors
+
+    Returns:
+        tuple: Positions of the results, latency of every query in ms
+    """
+    results = np.full((len(queries), k), -1, dtype=np.int64)
+    latencies = []
+    for i, query in enumerate(queries):
+        start = perf_counter()
+        _, indices = index.search(query[None, :], k * max(rescore_factor, 1))
+        positions = indices[0][indices[0] >= 0]
+        if rescore_factor and len(positions):
+            distances = ((full_index.reconstruct_batch(positions) - query) ** 2).sum(axis=1)
+            positions = positions[np.argsort(distances)]
+        latencies.append((perf_counter() - start) * 1000)
+        results[i, :min(k, len(positions))] = positions[:k]
+    return results, latencies
+
+def recall(results: np.ndarray, truth: np.ndarray) -> float:
+    return np.mean([len(set(r) & set(t)) / len(t) for r, t in zip(results, truth)])
+
+def measure(name: str, index: faiss.Index, full_index: faiss.Index, queries: np.ndarray, truth: np.ndarray, k: int, rescore_factor: int) -> list:
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "index.faiss")
+        faiss.write_index(index, path)
+        size = os.path.getsize(path)
+        start = perf_counter()
+        faiss.read_index(path)
+        load_time = (perf_counter() - start) * 1000
+    rows = []
+    for factor in ([0, rescore_factor] if name != "flat" else [0]):
+        results, latencies = search(index, full_index, queries, k, factor)
+        label = name if factor == 0 else f"{name}+rescore"
+        rows.append([label, size / 2**20, load_time, np.mean(latencies), np.percentile(latencies, 95), recall(results, truth)])
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description="Confronto tra l'indice float32 e le sue versioni compresse")
+    parser.add_argument("--db", help="Sovrascrive paths.db")
+    parser.add_argument("--methods", nargs="+", default=[m for m in METHODS if m != "none"], choices=METHODS[1:])
+    parser.add_argument("--queries", type=int, default=200, help="Numero di query di prova")
+    parser.add_argument("--k", type=int, default=14)
+    parser.add_argument("--rescore-factor", type=int, default=4)
+    args = parser.parse_args()
+
+    config = load_config()
+    db_path = args.db or versions.current(config['paths']['db'])
+    if db_path is None or not os.path.exists(os.path.join(db_path, "index.faiss")):
+        print(f"\33[1;31m[Report]\33[0m: Nessun database pubblicato in {args.db or config['paths']['db']}")
+        return
+    flat = faiss.read_index(os.path.join(db_path, "index.faiss"))
+    full_index = read_mapped(os.path.join(db_path, "index.faiss"))
+    data = vectors(flat)
+
+    # Query di prova: vettori del database con rumore, per non dipendere dall'API di embedding
+    rng = np.random.default_rng(0)
+    queries = data[rng.choice(len(data), min(args.queries, len(data)), replace=False)]
+    queries = (queries + rng.normal(0, data.std() * 0.5, queries.shape)).astype(np.float32)
+    _, truth = flat.search(queries, args.k)
+
+    rows = measure("flat", flat, full_index, queries, truth, args.k, 0)
+    options = config['compression']
+    for method in args.methods:
+        try:
+            index = build_index(data, method, options['dimensions'], options['pq_subquantizers'], options['pq_bits'])
+        except ValueError as e:
+            print(f"\33[1;31m[Report]\33[0m: {method} ignorato: {e}")
+            continue
+        rows += measure(method, index, full_index, queries, truth, args.k, args.rescore_factor)
+
+    print(f"\33[1;34m[Report]\33[0m: {flat.ntotal} vettori di dimensione {flat.d}, {len(queries)} query, recall@{args.k}")
+    # dimensione su disco dell'indice cercato; il ricalcolo legge dall'indice float32 mappato solo i vettori dei candidati
+    print(f"{'indice':<18}{'disco MB':>10}{'load ms':>10}{'query ms':>10}{'p95 ms':>10}{'recall':>10}")
+    for name, size, load_time, latency, p95, rec in rows:
+        print(f"{name:<18}{size:>10.2f}{load_time:>10.1f}{latency:>10.3f}{p95:>10.3f}{rec:>10.3f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+from langchain_community.vectorstores import FAISS
+from collections import Counter
+import numpy as np
+import unicodedata
+import pickle
+import re
+import os
+
+LEXICAL_INDEX = "lexical.pkl"
+# il chatbot ne ha una copia per le query: tests/test_chatbot_copies.py verifica che coincidano
+WORD = re.compile(r"\w+")
+STOPWORDS = {
+    "a", "ad", "al", "alla", "alle", "agli", "ai", "allo", "anche", "che", "chi", "ci", "come", "con", "cosa", "da", "dai",
+    "dal", "dalla", "dalle", "degli", "dei", "del", "della", "delle", "dello", "di", "e", "ed", "gli", "ha", "hanno", "i",
+    "il", "in", "io", "la", "le", "lo", "ma", "mi", "ne", "negli", "nei", "nel", "nella", "nelle", "non", "o", "per", "piu",
+    "quale", "quali", "quando", "questo", "questa", "se", "si", "sono", "su", "sul", "sulla", "tra", "fra", "un", "una", "uno",
+    # marcatori aggiunti dallo splitter a ogni chunk
+    "title", "source", "body", "description", "nurl"
+}
+
+def tokenize(text: str) -> list[str]:
+    """
+    Terms of a text: lowercase words without accents and stopwords.
+    The chatbot tokenizes the queries in the same way.
+    """
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return [t for t in WORD.findall(text) if t not in STOPWORDS]
+
+def build(vectorstores: list[FAISS], k1: float = 1.5, b: float = 0.75) -> dict:
+    """
+    Build the BM25 inverted index of the chunks of one or more vectorstores.
+    The weight of every term in every chunk is computed here, so a query only has
+    to sum the weights of its terms.
+
+    Args:
+        vectorstores (list[FAISS]): Vectorstores, e.g. the shards of the database
+        k1 (float): Saturation of the term frequency
+        b (float): Normalization by the length of the chunk
+
+    Returns:
+        dict: Docstore ids of the chunks and, for every term, the positions of its chunks and their weights
+    """
+    ids, counts = [], []
+    for vectorstore in vectorstores:
+        for position in sorted(vectorstore.index_to_docstore_id):
+            id = vectorstore.index_to_docstore_id[position]
+            ids.append(id)
+            counts.append(Counter(tokenize(vectorstore.docstore.search(id).page_content)))
+
+    lengths = np.array([sum(c.values()) for c in counts], dtype=np.float32)
+    norms = k1 * (1 - b + b * lengths / max(lengths.mean(), 1)) if len(counts) else lengths
+    postings = {}
+    for doc, terms in enumerate(counts):
+        for term, tf in terms.items():
+            postings.setdefault(term, ([], []))
+            postings[term][0].append(doc)
+            postings[term][1].append(tf * (k1 + 1) / (tf + norms[doc]))
+
+    index = {"ids": ids, "postings": {}}
+    for term, (docs, weights) in postings.items():
+        idf = np.log(1 + (len(ids) - len(docs) + 0.5) / (len(docs) + 0.5))
+        index["postings"][term] = (np.array(docs, dtype=np.int32), (np.array(weights) * idf).astype(np.float32))
+    return index
+
+def save(config: dict, vectorstores: list[FAISS], path: str) -> None:
+    """
+    Save the lexical index of the database, or remove the one of a previous build if it is disabled
+
+    Args:
+        config (dict): Configuration
+        vectorstores (list[FAISS]): Vectorstores of the database
+        path (str): Directory of the database
+    """
+    options = config['lexical']
+    index_path = os.path.join(path, LEXICAL_INDEX)
+    if not options['enabled']:
+        if os.path.exists(index_path):
+            os.remove(index_path)
+        return
+
+    index = build(vectorstores, k1=options['k1'], b=options['b'])
+    with open(index_path + ".tmp", "wb") as file:
+        pickle.dump(index, file, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(index_path + ".tmp", index_path)
+    print(f"\33[1;32m[Lexical]\33[0m: Indice BM25 salvato: {len(index['ids'])} chunks, {len(index['postings'])} termini")
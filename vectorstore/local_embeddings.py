@@ -0,0 +1,30 @@
+from langchain_core.embeddings import Embeddings
+
+# stessa classe di chatbot/backends.py, che deve produrre vettori confrontabili: tests/test_chatbot_copies.py verifica che coincidano
+
+class LocalEmbeddings(Embeddings):
+    """
+    Sentence-transformers bi-encoder running on the local CPU, optionally with ONNX Runtime.
+    Texts are encoded in batches; query and document prefixes are added for models that
+    need them (e.g. "query: " and "passage: " for E5).
+    """
+    def __init__(self, model: str, batch_size: int = 32, onnx: bool = False, threads: int = 0,
+                 query_prefix: str = "", document_prefix: str = ""):
+        from sentence_transformers import SentenceTransformer
+        import torch
+        if threads:
+            torch.set_num_threads(threads)
+        kwargs = {"backend": "onnx"} if onnx else {}
+        self.model = SentenceTransformer(model, device="cpu", **kwargs)
+        self.batch_size = batch_size
+        self.query_prefix = query_prefix
+        self.document_prefix = document_prefix
+
+    def encode(self, texts: list[str]) -> list[list[float]]:
+        return self.model.encode(texts, batch_size=self.batch_size, convert_to_numpy=True, show_progress_bar=False).tolist()
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return self.encode([self.document_prefix + t for t in texts])
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.encode([self.query_prefix + text])[0]
@@ -1,9 +1,11 @@
 from langchain_community.docstore import InMemoryDocstore
 from langchain_community.vectorstores import FAISS
-from langchain_cohere import CohereEmbeddings
 from data_manager import DataList
 from db_maker import DBMaker
-from utilities import load_config
+from manifest import Manifest
+from sharding import SHARDS_FILE
+from utilities import load_config, get_embedder
+import versions
 from dotenv import load_dotenv, find_dotenv
 import faiss
 import os
@@ -19,9 +21,10 @@ def main():
     # Load data
     data_list = DataList(config)
     data_list.add_dir(
-        path="txts_parags/",
+        path="docs/",
         chunk_size=1000,
-        chunk_overlap=0
+        chunk_overlap=0,
+        extra="Heading 2"
     )
     data_list.add(path="link.txt")
     
@@ -31,19 +34,47 @@ def main():
         return
     data = data_list.get_data()
     
-    embedder = CohereEmbeddings(model=config["embedder"])
+    embedder = get_embedder(config)
 
-    index = faiss.IndexFlatL2(len(embedder.embed_query("index")))
-    vectorstore = FAISS(
-        embedding_function=embedder,
-        index=index,
-        docstore=InMemoryDocstore(),
-        index_to_docstore_id={}
-    )
+    # Ogni build scrive una nuova versione del database; i chatbot la caricano solo dopo la pubblicazione
+    root = config['paths']['db']
+    base = versions.current(root)
+    can_update = base is not None and os.path.exists(os.path.join(base, Manifest.FILE_NAME)) and not os.path.exists(os.path.join(base, SHARDS_FILE))
+    update = config['build']['mode'] == "update" and can_update
+    diff = None
+    if update:
+        # calcolata una volta sola: la nuova versione parte da una copia dello stesso manifest
+        diff = Manifest.load(base, config['paths']['data']).diff(data)
+        changed, removed, _ = diff
+        if not changed and not removed:
+            print("\33[1;32m[Main]\33[0m: Nessuna sorgente modificata, il database resta alla versione corrente")
+            return
+    db_path = versions.create(root, base if update else None)
+    config['paths']['db'] = db_path
+    try:
+        if update:
+            vectorstore = FAISS.load_local(db_path, embeddings=embedder, allow_dangerous_deserialization=True)
+            db_maker = DBMaker(config, vectorstore)
+            db_maker.update(data, diff)
+        else:
+            index = faiss.IndexFlatL2(len(embedder.embed_query("index")))
+            vectorstore = FAISS(
+                embedding_function=embedder,
+                index=index,
+                docstore=InMemoryDocstore(),
+                index_to_docstore_id={}
+            )
 
-    db_maker = DBMaker(config, vectorstore)
-    db_maker.make(data)
-    print("\33[1;32m[Main]\33[0m: Database creato")
+            db_maker = DBMaker(config, vectorstore)
+            if config['build']['shards'] > 1:
+                db_maker.make_sharded(data)
+            else:
+                db_maker.make(data)
+    except BaseException as e:
+        versions.discard(db_path)
+        raise e
+    versions.publish(root, db_path, keep=config['build']['keep_versions'])
+    print(f"\33[1;32m[Main]\33[0m: Database {'aggiornato' if update else 'creato'}")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,138 @@
+from data_manager import Data, DataType
+import hashlib
+import json
+import os
+
+class Manifest():
+    """
+    Record of the sources stored in a database: content hash, chunking parameters
+    and ids of the chunks produced by each source.
+    """
+    FILE_NAME = "manifest.json"
+
+    def __init__(self, db_path: str, data_path: str):
+        self.db_path = db_path
+        self.data_path = data_path
+        self.sources = {}
+        self.next_id = 0
+
+    @classmethod
+    def load(cls, db_path: str, data_path: str) -> "Manifest":
+        """
+        Load the manifest of a database, or an empty one if it does not exist
+
+        Args:
+            db_path (str): Path of the database
+            data_path (str): Path of the data files
+
+        Returns:
+            Manifest: The manifest
+        """
+        manifest = cls(db_path, data_path)
+        path = os.path.join(db_path, cls.FILE_NAME)
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as file:
+                content = json.load(file)
+            manifest.sources = content["sources"]
+            manifest.next_id = content["next_id"]
+        return manifest
+
+    def save(self) -> None:
+        os.makedirs(self.db_path, exist_ok=True)
+        path = os.path.join(self.db_path, self.FILE_NAME)
+        with open(path + ".tmp", "w", encoding="utf-8") as file:
+            json.dump({"next_id": self.next_id, "sources": self.sources}, file, indent=2)
+        os.replace(path + ".tmp", path)
+
+    def files(self, data: Data) -> list[str]:
+        """
+        Files read by a local data source (a PDF source is a directory)
+        """
+        path = self.data_path + data.path
+        if os.path.isdir(path):
+            return sorted(os.path.join(root, f) for root, _, files in os.walk(path) for f in files)
+        return [path]
+
+    def stat(self, data: Data) -> list | None:
+        if data.data_type == DataType.WEB:
+            return None
+        return [[f, os.path.getsize(f), os.path.getmtime(f)] for f in self.files(data)]
+
+    def content_hash(self, data: Data) -> str | None:
+        """
+        Hash of the content of a data source, None for web sources that have not been downloaded
+        """
+        if data.data_type == DataType.WEB:
+            if data.content is None:
+                return None
+            return hashlib.sha256(data.content.encode("utf-8")).hexdigest()
+        digest = hashlib.sha256()
+        for f in self.files(data):
+            digest.update(os.path.relpath(f, self.data_path).encode("utf-8"))
+            with open(f, "rb") as file:
+                for block in iter(lambda: file.read(1 << 20), b""):
+                    digest.update(block)
+        return digest.hexdigest()
+
+    def fingerprint(self, data: Data) -> dict:
+        """
+        Fingerprint of a data source. The content hash is reused when size and
+        modification time of every file did not change since the last build.
+        """
+        stat = self.stat(data)
+        previous = self.sources.get(data.path)
+        if previous and stat is not None and previous["stat"] == stat:
+            content_hash = previous["fingerprint"]["hash"]
+        else:
+            content_hash = self.content_hash(data)
+        return {
+            "stat": stat,
+            "fingerprint": {
+                "type": data.data_type.name,
+                "hash": content_hash,
+                "chunk_size": data.chunk_size,
+                "chunk_overlap": data.chunk_overlap,
+                "extra": data.extra
+            }
+        }
+
+    def diff(self, data: list[Data]) -> tuple[list[Data], list[str], dict]:
+        """
+        Compare the data with the manifest.
+        Web pages are compared by the hash of the content downloaded by the WebFetcher.
+
+        Args:
+            data (list[Data]): List of data
+
+        Returns:
+            tuple: Added or changed data, paths of removed sources, fingerprints of the data
+        """
+        fingerprints = {d.path: self.fingerprint(d) for d in data}
+        changed = []
+        for d in data:
+            previous = self.sources.get(d.path)
+            current = fingerprints[d.path]["fingerprint"]
+            if previous is None or current["hash"] is None or previous["fingerprint"] != current:
+                changed.append(d)
+        paths = {d.path for d in data}
+        removed = [path for path in self.sources if path not in paths]
+        return changed, removed, fingerprints
+
+    def ids(self, path: str) -> list[int]:
+        if path not in self.sources:
+            return []
+        return self.sources[path]["ids"]
+
+    def record(self, path: str, fingerprint: dict, ids: list[int], complete: bool = True) -> None:
+        """
+        Record the chunks of a source. A source that failed after producing some chunks
+        is recorded without hash, so that the next update processes it again.
+        """
+        if not complete:
+            fingerprint = {**fingerprint, "fingerprint": {**fingerprint["fingerprint"], "hash": None}}
+        self.sources[path] = {**fingerprint, "ids": ids}
+        if ids:
+            self.next_id = max(self.next_id, max(ids) + 1)
+
+    def remove(self, path: str) -> None:
+        self.sources.pop(path, None)
@@ -0,0 +1,129 @@
+from langchain_community.docstore import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+from data_manager import Data, DataType
+from embedding import EmbeddingStage
+from splitter import Splitter
+from utilities import get_embedder
+import faiss
+import json
+import os
+
+SHARDS_FILE = "shards.json"
+WEB_SIZE = 100_000 # peso stimato di una pagina web nel bilanciamento degli shard
+
+def source_size(config: dict, data: Data) -> int:
+    if data.data_type == DataType.WEB:
+        return len(data.content) if data.content is not None else WEB_SIZE
+    path = config['paths']['data'] + data.path
+    if os.path.isdir(path):
+        return sum(os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk(path) for f in files)
+    return os.path.getsize(path)
+
+def partition(config: dict, data: list[Data], shards: int) -> list[list[int]]:
+    """
+    Split the sources into shards of similar size
+
+    Args:
+        config (dict): Configuration
+        data (list[Data]): List of data
+        shards (int): Number of shards
+
+    Returns:
+        list[list[int]]: Indexes of the sources of every shard, in data order
+    """
+    sizes = [0] * shards
+    parts = [[] for _ in range(shards)]
+    by_size = sorted(range(len(data)), key=lambda i: source_size(config, data[i]), reverse=True)
+    for i in by_size:
+        lightest = sizes.index(min(sizes))
+        parts[lightest].append(i)
+        sizes[lightest] += source_size(config, data[i])
+    return [sorted(part) for part in parts if part]
+
+def build_shard(config: dict, shard: int, data: list[Data], dimension: int) -> tuple[str, dict, list]:
+    """
+    Build a partial index in a worker process
+
+    Args:
+        config (dict): Configuration
+        shard (int): Shard number
+        data (list[Data]): Sources of the shard
+        dimension (int): Dimension of the vectors
+
+    Returns:
+        tuple: Path of the shard, chunk ids of every source (local to the shard), errors
+    """
+    path = os.path.join(config['paths']['db'], f"shard_{shard}")
+    vectorstore = FAISS(
+        embedding_function=get_embedder(config),
+        index=faiss.IndexFlatL2(dimension),
+        docstore=InMemoryDocstore(),
+        index_to_docstore_id={}
+    )
+    splitter = Splitter(config['paths']['data'], workers=1, cache_dir=config['paths']['cache']) # il parallelismo è dato dagli shard
+    stage = EmbeddingStage(
+        vectorstore.embedding_function,
+        checkpoint_dir=config['paths']['cache'] + f"checkpoints/shard_{shard}/",
+        max_tokens=config['embedding']['max_tokens'],
+        max_items=config['embedding']['max_items'],
+        concurrency=config['embedding']['concurrency'],
+        retries=config['embedding']['retries'],
+        backoff=config['embedding']['backoff']
+    )
+    for batch, vectors in stage.run(splitter.iter_chunks(data)):
+        vectorstore.add_embeddings(
+            zip([d.page_content for d in batch], vectors.tolist()),
+            metadatas=[d.metadata for d in batch],
+            ids=[str(d.metadata["id"]) for d in batch]
+        )
+    vectorstore.save_local(path)
+    stage.clear()
+    print(f"\33[1;32m[Shard {shard}]\33[0m: {vectorstore.index.ntotal} vettori da {len(data)} sorgenti")
+    return path, splitter.source_ids, splitter.errors
+
+def global_ids(data: list[Data], results: list[tuple[list[int], dict]]) -> tuple[dict, dict]:
+    """
+    Assign the final chunk ids following the order of the data, so that they are
+    the same a non-sharded build would produce
+
+    Args:
+        data (list[Data]): List of data
+        results (list[tuple[list[int], dict]]): Source indexes and local source ids of every shard
+
+    Returns:
+        tuple: Map (shard, local id) -> global id, global ids of every source
+    """
+    local = {}
+    for shard, (indexes, source_ids) in enumerate(results):
+        for i in indexes:
+            if data[i].path in source_ids:
+                local[i] = (shard, source_ids[data[i].path])
+    mapping = {}
+    source_ids = {}
+    next_id = 0
+    for i in sorted(local):
+        shard, ids = local[i]
+        source_ids[data[i].path] = list(range(next_id, next_id + len(ids)))
+        for local_id in ids:
+            mapping[(shard, local_id)] = next_id
+            next_id += 1
+    return mapping, source_ids
+
+def remap(vectorstore: FAISS, shard: int, mapping: dict) -> None:
+    """
+    Replace the local chunk ids of a shard with the global ones
+    """
+    docstore = {}
+    index_to_docstore_id = {}
+    for position, old_id in vectorstore.index_to_docstore_id.items():
+        doc = vectorstore.docstore.search(old_id)
+        new_id = mapping[(shard, doc.metadata["id"])]
+        docstore[str(new_id)] = Document(page_content=doc.page_content, metadata={**doc.metadata, "id": new_id})
+        index_to_docstore_id[position] = str(new_id)
+    vectorstore.docstore = InMemoryDocstore(docstore)
+    vectorstore.index_to_docstore_id = index_to_docstore_id
+
+def save_shards_file(db_path: str, names: list[str]) -> None:
+    with open(os.path.join(db_path, SHARDS_FILE), "w", encoding="utf-8") as file:
+        json.dump({"shards": names}, file, indent=2)
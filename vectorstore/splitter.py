@@ -1,49 +1,157 @@
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_core.documents import Document
 from langchain_community.document_loaders import (
-    PyPDFDirectoryLoader,
-    TextLoader,
-    WebBaseLoader,
-    DataFrameLoader
+    WebBaseLoader
 )
 
 from data_manager import Data, DataType
+from docx import Document as DocxDocument
+from pypdf import PdfReader
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from collections import deque
+from itertools import islice
+from typing import Iterable, Iterator
 
 import pandas as pd
+import hashlib
+import json
 import bs4
+import os
+
+CSV_ROWS = 5000 # righe dei file CSV lette alla volta
+
+def pdf_files(path: str) -> list[str]:
+    """
+    PDF files of a source: the file itself or the visible PDFs of a directory and its subdirectories
+    """
+    if os.path.isfile(path):
+        return [path]
+    files = []
+    for root, dirs, names in os.walk(path):
+        dirs[:] = [d for d in dirs if not d.startswith(".")]
+        files += [os.path.join(root, f) for f in names if f.lower().endswith(".pdf") and not f.startswith(".")]
+    return sorted(files)
+
+def parse_pdf(path: str, cache_dir: str = None) -> list[str]:
+    """
+    Extract the text of every page of a PDF, using the page cache if the file was already parsed
+
+    Args:
+        path (str): Path of the PDF
+        cache_dir (str): Directory of the page cache, None to disable it
+
+    Returns:
+        list[str]: Text of the pages
+    """
+    cache_path = None
+    if cache_dir:
+        digest = hashlib.sha256()
+        with open(path, "rb") as file:
+            for block in iter(lambda: file.read(1 << 20), b""):
+                digest.update(block)
+        cache_path = os.path.join(cache_dir, digest.hexdigest() + ".json")
+        if os.path.exists(cache_path):
+            with open(cache_path, "r", encoding="utf-8") as file:
+                return json.load(file)
+
+    pages = [page.extract_text() for page in PdfReader(path).pages]
+    if cache_path:
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(cache_path + ".tmp", "w", encoding="utf-8") as file:
+            json.dump(pages, file)
+        os.replace(cache_path + ".tmp", cache_path)
+    return pages
+
+def load_source(dir_path: str, cache_dir: str, data: Data) -> list[Document]:
+    """
+    Create the chunks of a data source in a worker process. Only the paths and the source
+    are sent to the process, not the splitter with the state of the build.
+    """
+    return Splitter(dir_path, cache_dir=cache_dir).load(data)
 
 class Splitter():
-    def __init__(self, dir_path: dict):
+    def __init__(self, dir_path: str, workers: int = 1, web_threads: int = 8, cache_dir: str = None):
         self.dir_path = dir_path
+        self.cache_dir = cache_dir # cache delle pagine dei PDF (None = disabilitata)
+        self.workers = workers # processi per i file locali (0 = tutti i core, 1 = seriale)
+        self.web_threads = web_threads # thread per le pagine web
+        self.errors = []
+        self.source_ids = {}
     
+    def split_text(self, text: str, data: Data, metadata: dict) -> list[Document]:
+        """
+        Split a text whose first line is its title, prefixing every chunk with title and source
+        """
+        title = text.split("\n", 1)[0].strip()
+        chunk_size = data.chunk_size or len(text) # Set chunk size to the length of the document
+        splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=data.chunk_overlap)
+        splits = splitter.split_documents([Document(page_content=text, metadata=metadata)])
+        new_splits = []
+        for s in splits:
+            s.metadata["title"] = title
+            source = data.path
+            content = s.page_content
+            if title == content and len(splits) > 1:
+                continue # Skip if title is the same as content and there are multiple chunks
+            final_content = f"\\TITLE: {title}\\SOURCE: {source}\\BODY: {content}"
+            s.page_content = final_content
+            new_splits.append(s)
+        return new_splits
+
     def TextChunks(self, data: Data) -> list[Document]:
         try:
             path = self.dir_path + data.path
-            loader = TextLoader(path, encoding="utf-8")
-            if data.chunk_size == 0:
-                data.chunk_size = len(open(path, "r", encoding="utf-8").read()) # Set chunk size to the length of the document
-            splitter = RecursiveCharacterTextSplitter(chunk_size=data.chunk_size, chunk_overlap=data.chunk_overlap)
-            loaded = loader.load()
-            splits = splitter.split_documents(loaded)
-            new_splits = []
-            for s in splits:
-                title = open(path, "r", encoding="utf-8").readline().strip()
-                s.metadata["title"] = title
-                source = data.path
-                content = s.page_content
-                if title == content and len(splits) > 1:
-                    continue # Skip if title is the same as content and there are multiple chunks
-                final_content = f"\\TITLE: {title}\\SOURCE: {source}\\BODY: {content}"
-                s.page_content = final_content
-                new_splits.append(s)
+            with open(path, "r", encoding="utf-8") as file:
+                text = file.read() # il file viene letto una sola volta
+            new_splits = self.split_text(text, data, {"source": path})
             print(f"\33[1;32m[Splitter]\33[0m: Creati {len(new_splits)} chunks di tipo Text per", data.path)
             return new_splits
         except Exception as e:
             print(f"\33[1;31m[Splitter]\33[0m: Errore durante la creazione dei chunks di tipo Text di {data.path}: {e}")
             raise e
+
+    def DocxChunks(self, data: Data) -> list[Document]:
+        """
+        Split a Word document into sections starting at every paragraph with the header style
+        given in data.extra (Heading 2 by default). Every section is chunked as a text file
+        whose first line is the header; the first paragraph of the document is skipped.
+        """
+        try:
+            path = self.dir_path + data.path
+            header = data.extra if data.extra != "None" else "Heading 2"
+            doc = DocxDocument(path)
+            sections = []
+            current_paragraphs = []
+            for para in doc.paragraphs[1:]:
+                if para.style.name == header:
+                    if current_paragraphs:
+                        sections.append(current_paragraphs)
+                    current_paragraphs = [para.text]
+                else:
+                    current_paragraphs.append(para.text)
+            if current_paragraphs:
+                sections.append(current_paragraphs)
+
+            new_splits = []
+            for index, paragraphs in enumerate(sections):
+                new_splits += self.split_text("\n".join(paragraphs), data, {"source": path, "section": index})
+            print(f"\33[1;32m[Splitter]\33[0m: Creati {len(new_splits)} chunks di tipo Docx per", data.path)
+            return new_splits
+        except Exception as e:
+            print(f"\33[1;31m[Splitter]\33[0m: Errore durante la creazione dei chunks di tipo Docx di {data.path}: {e}")
+            raise e
     
     def WebChunks(self, data: Data) -> list[Document]:
         try:
+            if data.content is not None: # pagina già scaricata dal WebFetcher
+                soup = bs4.BeautifulSoup(data.content, "html.parser", parse_only=bs4.SoupStrainer(class_=(data.extra)))
+                metadata = {"source": data.path}
+                if title := soup.find("title"):
+                    metadata["title"] = title.get_text()
+                splitter = RecursiveCharacterTextSplitter(chunk_size=data.chunk_size, chunk_overlap=data.chunk_overlap)
+                splits = splitter.split_documents([Document(page_content=soup.get_text(), metadata=metadata)])
+                print(f"\33[1;32m[Splitter]\33[0m: Creati {len(splits)} chunks di tipo Web per", data.path)
+                return splits
             loader = WebBaseLoader(
                 web_paths=(data.path,),
                 bs_kwargs=dict(
@@ -62,65 +170,195 @@ class Splitter():
             print(f"\33[1;31m[Splitter]\33[0m: Errore durante la creazione dei chunks di tipo Web di {data.path}: {e}")
             raise e
     
-    def PDFChunks(self, data: Data) -> list[Document]:
+    def PDFChunks(self, data: Data, executor: Executor = None, window: int = 4) -> Iterator[Document]:
+        """
+        Stream the chunks of a PDF file or of a directory of PDFs.
+        Every file is parsed on its own, in the executor if given, and its pages are
+        cached by file hash so that unchanged files are not parsed again.
+        At most window files are parsed ahead of the chunks consumed by the caller.
+        """
+        pending = deque()
         try:
             path = self.dir_path + data.path
-            loader = PyPDFDirectoryLoader(path)
+            files = pdf_files(path)
+            cache_dir = self.cache_dir + "pdf/" if self.cache_dir else None
             splitter = RecursiveCharacterTextSplitter(chunk_size=data.chunk_size, chunk_overlap=data.chunk_overlap)
-            loaded = loader.load()
-            splits = splitter.split_documents(loaded)
-            print(f"\33[1;32m[Splitter]\33[0m: Creati {len(splits)} chunks di tipo PDF per", data.path)
-            return splits
+            if executor is not None:
+                remaining = iter(files)
+                for f in islice(remaining, window):
+                    pending.append(executor.submit(parse_pdf, f, cache_dir))
+                def next_parsed() -> list[str]:
+                    future = pending.popleft()
+                    for f in islice(remaining, 1):
+                        pending.append(executor.submit(parse_pdf, f, cache_dir))
+                    return future.result()
+                parsed = (next_parsed() for _ in files)
+            else:
+                parsed = (parse_pdf(f, cache_dir) for f in files)
+            count = 0
+            for f, pages in zip(files, parsed):
+                loaded = [Document(page_content=text, metadata={"source": f, "page": page}) for page, text in enumerate(pages)]
+                splits = splitter.split_documents(loaded)
+                count += len(splits)
+                yield from splits
+            print(f"\33[1;32m[Splitter]\33[0m: Creati {count} chunks di tipo PDF per", data.path)
         except Exception as e:
             print(f"\33[1;31m[Splitter]\33[0m: Errore durante la creazione dei chunks di tipo PDF di {data.path}: {e}")
             raise e
+        finally:
+            for future in pending: # stream interrotto: i file non ancora letti non servono più
+                future.cancel()
     
-    def DFChunks(self, data: Data) -> list[Document]:
+    def DFChunks(self, data: Data) -> Iterator[Document]:
+        """
+        Stream the chunks of a CSV file, reading CSV_ROWS rows at a time and only the
+        columns that are used, so that memory does not depend on the size of the file.
+        The page content of a whole block of rows is formatted at once.
+        """
         try:
             path = self.dir_path + data.path
-            df = pd.read_csv(path)
-            loader = DataFrameLoader(df, page_content_column=data.extra)
-            splitter = RecursiveCharacterTextSplitter(chunk_size=data.chunk_size, chunk_overlap=data.chunk_overlap)
-            loaded = loader.load()
-            splits = splitter.split_documents(loaded)
-            for s in splits:
-                title = s.metadata["title"]
-                description = s.metadata["description"]
-                content = s.page_content
-                url = s.metadata["url"]
-                final_content = f"\\TITLE: {title}\\DESCRIPTION: {description}\\BODY: {content}\\nURL: {url}"
-                s.page_content = final_content
-            print(f"\33[1;32m[Splitter]\33[0m: Creati {len(splits)} chunks di tipo DataFrame per", data.path)
-            return splits
+            columns = [data.extra, "title", "description", "url"]
+            splitter = RecursiveCharacterTextSplitter(chunk_size=data.chunk_size, chunk_overlap=data.chunk_overlap) if data.chunk_size else None
+            count = 0
+            for df in pd.read_csv(path, usecols=columns, dtype=str, keep_default_na=False, chunksize=CSV_ROWS):
+                body = df[data.extra].str.strip()
+                if splitter is not None:
+                    long = body.str.len() > data.chunk_size
+                    if long.any():
+                        body = body.astype(object)
+                        body[long] = body[long].map(splitter.split_text)
+                        body = body.explode()
+                df = df.drop(columns=data.extra).join(body.rename("body"), how="inner")
+                df = df[df["body"].str.len() > 0]
+                contents = "\\TITLE: " + df["title"] + "\\DESCRIPTION: " + df["description"] + "\\BODY: " + df["body"] + "\\nURL: " + df["url"]
+                metadatas = df[["title", "description", "url"]].to_dict("records")
+                for content, metadata in zip(contents, metadatas):
+                    yield Document(page_content=content, metadata={"source": path, **metadata})
+                count += len(df)
+            print(f"\33[1;32m[Splitter]\33[0m: Creati {count} chunks di tipo DataFrame per", data.path)
         except Exception as e:
             print(f"\33[1;31m[Splitter]\33[0m: Errore durante la creazione dei chunks di tipo DataFrame di {data.path}: {e}")
             raise e
     
-    def create_chunks(self, data: list[Data]) -> list[Document]:
+    def load(self, data: Data) -> Iterable[Document]:
+        """
+        Create the chunks of a single data source
+
+        Args:
+            data (Data): Data source
+
+        Returns:
+            Iterable[Document]: List of chunks, or a stream for CSV files
+        """
+        if data.data_type == DataType.TEXT:
+            return self.TextChunks(data)
+        if data.data_type == DataType.WEB:
+            return self.WebChunks(data)
+        if data.data_type == DataType.PDF:
+            return self.PDFChunks(data)
+        if data.data_type == DataType.CSV:
+            return self.DFChunks(data)
+        if data.data_type == DataType.DOCX:
+            return self.DocxChunks(data)
+        raise ValueError(f"Tipo di dato non supportato: {data.data_type}")
+
+    def iter_loaded(self, data: list[Data]):
+        """
+        Load the data sources, in parallel if enabled, keeping only a bounded window of
+        sources in flight
+
+        Args:
+            data (list[Data]): List of data
+
+        Yields:
+            tuple[Data, Iterable[Document] | None]: Every source with its chunks (None if it failed), in order.
+            CSV files and PDFs are streamed from the main process, the stream is consumed by the caller;
+            the files of a PDF source are parsed in the process pool.
+        """
+        if self.workers == 1:
+            for d in data:
+                try:
+                    yield d, self.load(d)
+                except Exception as e:
+                    self.errors.append((d.path, str(e)))
+                    yield d, None
+            return
+
+        window = 2 * (self.workers or os.cpu_count())
+        with ProcessPoolExecutor(max_workers=self.workers or None) as processes, \
+             ThreadPoolExecutor(max_workers=self.web_threads) as threads:
+            sources = iter(data)
+            pending = deque()
+
+            def submit(d: Data):
+                if d.data_type in (DataType.CSV, DataType.PDF):
+                    pending.append((d, None))
+                    return
+                if d.data_type == DataType.WEB:
+                    pending.append((d, threads.submit(self.load, d)))
+                else:
+                    pending.append((d, processes.submit(load_source, self.dir_path, self.cache_dir, d)))
+
+            for d in islice(sources, window):
+                submit(d)
+            while pending:
+                d, future = pending.popleft()
+                for next_d in islice(sources, 1):
+                    submit(next_d)
+                if future is None:
+                    yield d, self.DFChunks(d) if d.data_type == DataType.CSV else self.PDFChunks(d, processes, window)
+                    continue
+                try:
+                    yield d, future.result()
+                except Exception as e:
+                    self.errors.append((d.path, str(e)))
+                    yield d, None
+
+    def iter_chunks(self, data: list[Data], start_id: int = 0):
+        """
+        Create chunks of given data as a stream.
+        Local files are parsed in a process pool and web pages are fetched in a thread pool;
+        a failing source is recorded in self.errors without aborting the others.
+        A streamed source failing midway keeps the ids of the chunks it already produced.
+
+        Args:
+            data (list[Data]): List of data
+            start_id (int): First chunk id
+
+        Yields:
+            Document: Chunks with unique IDs, following the order of the data (not of completion)
+        """
+        self.errors = []
+        self.source_ids = {}
+        next_id = start_id
+
+        for d, result in self.iter_loaded(data):
+            if result is None:
+                continue
+            ids = []
+            try:
+                for chunk in result:
+                    chunk.metadata["id"] = next_id
+                    ids.append(next_id)
+                    next_id += 1
+                    yield chunk
+            except Exception as e:
+                self.errors.append((d.path, str(e)))
+            self.source_ids[d.path] = ids
+
+        for path, error in self.errors:
+            print(f"\33[1;31m[Splitter]\33[0m: Sorgente {path} ignorata: {error}")
+        print(f"\33[1;32m[Splitter]\33[0m: Creati {next_id - start_id} chunks totali")
+
+    def create_chunks(self, data: list[Data], start_id: int = 0) -> list[Document]:
         """
         Create chunks of given data
 
         Args:
             data (list[Data]): List of data
+            start_id (int): First chunk id
 
         Returns:
             list[Document]: List of chunks
         """
-        chunks = []
-
-        for d in data:
-            if d.data_type == DataType.TEXT:
-                chunks += self.TextChunks(d)
-            elif d.data_type == DataType.WEB:
-                chunks += self.WebChunks(d)
-            elif d.data_type == DataType.PDF:
-                chunks += self.PDFChunks(d)
-            elif d.data_type == DataType.CSV:
-                chunks += self.DFChunks(d)
-        
-        # Assign unique IDs to each chunk
-        for i, chunk in enumerate(chunks):
-            chunk.metadata["id"] = i
-        
-        print(f"\33[1;32m[Splitter]\33[0m: Creati {len(chunks)} chunks totali")
-        return chunks
\ No newline at end of file
+        return list(self.iter_chunks(data, start_id))
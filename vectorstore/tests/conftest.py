@@ -0,0 +1,5 @@
+import sys
+import os
+
+# i moduli del vectorstore si importano come script, dalla loro cartella
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,66 @@
+"""
+The chatbot and the vectorstore run as separate scripts and keep their own copy of the
+code that must behave the same on both sides: the tokenizer of the BM25 index and the
+local embedder. If a copy changes alone, queries stop matching the indexed terms or
+vectors stop being comparable; these tests catch it.
+"""
+from importlib.util import module_from_spec, spec_from_file_location
+import numpy as np
+import hashlib
+import types
+import sys
+import os
+import pytest
+import lexical
+import local_embeddings
+
+CHATBOT = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "chatbot")
+
+def chatbot_module(name: str, monkeypatch) -> types.ModuleType:
+    """Import a module of the chatbot without shadowing the vectorstore modules with the same name"""
+    monkeypatch.syspath_prepend(CHATBOT)
+    spec = spec_from_file_location(f"chatbot_{name}", os.path.join(CHATBOT, f"{name}.py"))
+    module = module_from_spec(spec)
+    spec.loader.exec_module(module)
+    sys.path.remove(CHATBOT)
+    return module
+
+TEXTS = [
+    "Qual è l'orario della segreteria didattica?",
+    "\\TITLE: Tasse universitarie\\SOURCE: docs/tasse.pdf\\BODY: La prima rata è dovuta entro il 5 novembre.\\nURL: https://example.org",
+    "PERCHÉ più città, più università: ÀÈÌÒÙ àèìòù ç ñ",
+    "del della dello per con su tra fra e o ma",
+    "snake_case numeri 2024 e 3.14"
+]
+
+def test_tokenizers_match(monkeypatch):
+    chatbot_lexical = chatbot_module("lexical", monkeypatch)
+    assert chatbot_lexical.STOPWORDS == lexical.STOPWORDS
+    assert chatbot_lexical.WORD.pattern == lexical.WORD.pattern
+    for text in TEXTS:
+        assert chatbot_lexical.tokenize(text) == lexical.tokenize(text)
+
+class FakeSentenceTransformer():
+    def __init__(self, model: str, device: str = None, **kwargs):
+        self.init = (model, device, kwargs)
+
+    def encode(self, texts, **kwargs):
+        self.kwargs = kwargs
+        return np.array([np.frombuffer(hashlib.sha256(t.encode("utf-8")).digest(), dtype=np.uint8) / 255 for t in texts])
+
+def test_local_embeddings_match(monkeypatch):
+    threads = []
+    monkeypatch.setitem(sys.modules, "sentence_transformers", types.SimpleNamespace(SentenceTransformer=FakeSentenceTransformer))
+    monkeypatch.setitem(sys.modules, "torch", types.SimpleNamespace(set_num_threads=threads.append))
+    pytest.importorskip("langchain_cohere")
+    backends = chatbot_module("backends", monkeypatch)
+
+    options = dict(batch_size=7, onnx=True, threads=3, query_prefix="query: ", document_prefix="passage: ")
+    chatbot = backends.LocalEmbeddings("intfloat/multilingual-e5-small", **options)
+    vectorstore = local_embeddings.LocalEmbeddings("intfloat/multilingual-e5-small", **options)
+
+    assert chatbot.model.init == vectorstore.model.init
+    assert threads == [3, 3]
+    assert chatbot.embed_documents(TEXTS) == vectorstore.embed_documents(TEXTS)
+    assert chatbot.embed_query(TEXTS[0]) == vectorstore.embed_query(TEXTS[0])
+    assert chatbot.model.kwargs == vectorstore.model.kwargs
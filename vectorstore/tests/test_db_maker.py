@@ -0,0 +1,112 @@
+from langchain_community.embeddings import DeterministicFakeEmbedding
+from langchain_community.docstore import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+import pytest
+import faiss
+import os
+from data_manager import DataList
+from db_maker import DBMaker
+from manifest import Manifest
+import splitter
+
+embedder = DeterministicFakeEmbedding(size=16)
+
+@pytest.fixture
+def config(tmp_path):
+    for name in ("data", "db", "cache"):
+        os.makedirs(tmp_path / name)
+    return {
+        'paths': {'db': f"{tmp_path}/db/", 'data': f"{tmp_path}/data/", 'cache': f"{tmp_path}/cache/"},
+        'build': {'mode': "update"},
+        'ingestion': {'workers': 1, 'web_threads': 1},
+        'web': {'min_interval': 0, 'timeout': 5},
+        'embedding': {'concurrency': 1, 'max_tokens': 1000, 'max_items': 8, 'retries': 1, 'backoff': 0},
+        'dedup': {'enabled': False, 'threshold': 0.85},
+        'compression': {'method': "none"},
+        'lexical': {'enabled': False}
+    }
+
+def write(config: dict, name: str, words: str) -> None:
+    with open(config['paths']['data'] + name, "w", encoding="utf-8") as file:
+        file.write(f"Titolo {name}\n" + "\n\n".join(f"{words} paragrafo {i}" for i in range(3)))
+
+def data(config: dict) -> list:
+    data_list = DataList(config)
+    data_list.add_dir(chunk_size=40)
+    return data_list.get_data()
+
+def build(config: dict) -> FAISS:
+    vectorstore = FAISS(embedding_function=embedder, index=faiss.IndexFlatL2(16), docstore=InMemoryDocstore(), index_to_docstore_id={})
+    DBMaker(config, vectorstore).make(data(config))
+    return vectorstore
+
+def update(config: dict) -> FAISS:
+    vectorstore = FAISS.load_local(config['paths']['db'], embedder, allow_dangerous_deserialization=True)
+    DBMaker(config, vectorstore).update(data(config))
+    return vectorstore
+
+def contents(vectorstore: FAISS) -> dict[str, set[str]]:
+    """Bodies of the chunks by source file, only for the chunks that have a vector"""
+    sources = {}
+    for id in vectorstore.index_to_docstore_id.values():
+        doc = vectorstore.docstore.search(id)
+        sources.setdefault(os.path.basename(doc.metadata["source"]), set()).add(doc.page_content.split("\\BODY: ")[1])
+    return sources
+
+def text(found: dict[str, set[str]], name: str) -> str:
+    return " ".join(sorted(found[name]))
+
+def test_update_adds_modifies_and_deletes_sources(config):
+    write(config, "kept.txt", "invariato")
+    write(config, "changed.txt", "vecchio")
+    write(config, "deleted.txt", "eliminato")
+    build(config)
+    kept_ids = Manifest.load(config['paths']['db'], config['paths']['data']).ids("kept.txt")
+
+    write(config, "changed.txt", "nuovo testo")
+    write(config, "added.txt", "aggiunto")
+    os.remove(config['paths']['data'] + "deleted.txt")
+    vectorstore = update(config)
+
+    found = contents(vectorstore)
+    assert set(found) == {"kept.txt", "changed.txt", "added.txt"}
+    assert "nuovo testo" in text(found, "changed.txt") and "vecchio" not in text(found, "changed.txt")
+    assert "aggiunto" in text(found, "added.txt")
+    assert vectorstore.index.ntotal == len(vectorstore.docstore._dict) == sum(len(bodies) for bodies in found.values())
+
+    manifest = Manifest.load(config['paths']['db'], config['paths']['data'])
+    assert set(manifest.sources) == {"kept.txt", "changed.txt", "added.txt"}
+    assert manifest.ids("kept.txt") == kept_ids
+    ids = [id for path in manifest.sources for id in manifest.ids(path)]
+    assert sorted(str(id) for id in ids) == sorted(vectorstore.index_to_docstore_id.values())
+
+    # senza modifiche l'aggiornamento non tocca nulla
+    assert contents(update(config)) == found
+
+def test_failed_source_keeps_previous_vectors(config, monkeypatch):
+    write(config, "flaky.txt", "originale")
+    write(config, "other.txt", "altro")
+    build(config)
+    old_ids = Manifest.load(config['paths']['db'], config['paths']['data']).ids("flaky.txt")
+
+    write(config, "flaky.txt", "modificato")
+    load = splitter.Splitter.load
+    def failing(self, d):
+        if d.path != "flaky.txt":
+            return load(self, d)
+        def chunks():
+            yield from load(self, d)[:1]
+            raise RuntimeError("file illeggibile")
+        return chunks()
+    monkeypatch.setattr(splitter.Splitter, "load", failing)
+    vectorstore = update(config)
+
+    found = contents(vectorstore)
+    assert "originale" in text(found, "flaky.txt") and "modificato" not in text(found, "flaky.txt")
+    manifest = Manifest.load(config['paths']['db'], config['paths']['data'])
+    assert manifest.ids("flaky.txt") == old_ids
+    assert manifest.sources["flaky.txt"]["fingerprint"]["hash"] is None # riprovata al prossimo aggiornamento
+
+    monkeypatch.setattr(splitter.Splitter, "load", load)
+    found = contents(update(config))
+    assert "modificato" in text(found, "flaky.txt") and "originale" not in text(found, "flaky.txt")
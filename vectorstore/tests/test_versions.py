@@ -0,0 +1,23 @@
+import os
+import versions
+
+def test_publish_keeps_the_version_current_before_it(tmp_path):
+    root = str(tmp_path)
+    published = []
+    for _ in range(3):
+        path = versions.create(root)
+        versions.publish(root, path, keep=1)
+        published.append(os.path.basename(os.path.normpath(path)))
+        assert versions.current(root) == path
+
+    assert sorted(os.listdir(os.path.join(root, versions.VERSIONS_DIR))) == published[1:]
+
+def test_create_copies_the_base_version(tmp_path):
+    root = str(tmp_path)
+    base = versions.create(root)
+    with open(os.path.join(base, "index.faiss"), "w") as file:
+        file.write("indice")
+    copy = versions.create(root, base)
+    with open(os.path.join(copy, "index.faiss")) as file:
+        assert file.read() == "indice"
+    assert versions.current(root) is None
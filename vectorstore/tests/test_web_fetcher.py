@@ -0,0 +1,131 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+from collections import defaultdict
+from time import monotonic
+import threading
+import socket
+import pytest
+from web_fetcher import WebFetcher
+import web_fetcher
+
+ETAG = '"v1"'
+LAST_MODIFIED = "Wed, 01 Jan 2025 00:00:00 GMT"
+
+class Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == "/etag" and self.headers.get("If-None-Match") == ETAG:
+            self.answer(304)
+        elif self.path == "/modified" and self.headers.get("If-Modified-Since") == LAST_MODIFIED:
+            self.answer(304)
+        elif self.path in ("/etag", "/modified") or self.path.startswith("/page"):
+            self.answer(200, f"contenuto di {self.path}", {"ETag": ETAG} if self.path == "/etag" else {"Last-Modified": LAST_MODIFIED})
+        else:
+            self.answer(404, "non trovata")
+
+    def answer(self, status: int, body: str = "", headers: dict = {}):
+        payload = body.encode("utf-8") if status != 304 else b""
+        self.server.log.append((monotonic(), self.path, status, len(payload))) # prima della risposta, che sblocca il client
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        if status != 304:
+            self.send_header("Content-Type", "text/plain; charset=utf-8")
+            self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.log = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def url(server, path: str, host: str = "127.0.0.1") -> str:
+    return f"http://{host}:{server.server_address[1]}{path}"
+
+@pytest.mark.parametrize("path", ["/etag", "/modified"])
+def test_conditional_request_skips_body(server, tmp_path, path):
+    fetcher = WebFetcher(str(tmp_path), min_interval=0)
+    first = fetcher.fetch(url(server, path))
+    assert first.ok and first.status == 200 and not first.unchanged
+
+    second = WebFetcher(str(tmp_path), min_interval=0).fetch(url(server, path)) # cache letta da disco
+    assert second.ok and second.status == 304 and second.unchanged
+    assert second.content == first.content == f"contenuto di {path}"
+    assert [(status, size) for _, _, status, size in server.log] == [(200, len(first.content)), (304, 0)]
+
+class FakeClock():
+    """Clock of the fetcher: time only moves when the fetcher sleeps, so the intervals do not depend on the machine"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.now = 1000.0
+        self.sleeps = []
+
+    def monotonic(self) -> float:
+        with self.lock:
+            return self.now
+
+    def sleep(self, seconds: float) -> None:
+        with self.lock:
+            self.sleeps.append(seconds)
+            self.now += seconds
+
+class TurnLog(dict):
+    """host_last of the fetcher, recording the time at which every request got its turn (under the lock of the host)"""
+    def __init__(self):
+        super().__init__()
+        self.turns = defaultdict(list)
+
+    def __setitem__(self, host: str, time: float) -> None:
+        self.turns[host].append(time)
+        super().__setitem__(host, time)
+
+def turns(fetcher: WebFetcher, clock: FakeClock, monkeypatch) -> dict[str, list[float]]:
+    monkeypatch.setattr(web_fetcher, "monotonic", clock.monotonic)
+    monkeypatch.setattr(web_fetcher, "sleep", clock.sleep)
+    fetcher.host_last = TurnLog()
+    return fetcher.host_last.turns
+
+def test_min_interval_per_host(server, tmp_path, monkeypatch):
+    clock = FakeClock()
+    fetcher = WebFetcher(str(tmp_path), threads=1, min_interval=0.2)
+    recorded = turns(fetcher, clock, monkeypatch)
+    first, other = url(server, "/page"), url(server, "/page", host="localhost")
+    pages = fetcher.fetch_all([f"{first}0", f"{other}0", f"{first}1", f"{other}1", f"{first}2", f"{first}3"])
+    assert all(page.ok for page in pages.values())
+
+    # solo le richieste allo stesso host aspettano: la seconda di localhost trova l'intervallo già trascorso
+    assert clock.sleeps == pytest.approx([0.2, 0.2, 0.2])
+    assert recorded[urlparse(first).netloc] == pytest.approx([1000.0, 1000.2, 1000.4, 1000.6])
+    assert recorded[urlparse(other).netloc] == pytest.approx([1000.0, 1000.2])
+
+def test_min_interval_with_concurrent_requests(server, tmp_path, monkeypatch):
+    clock = FakeClock()
+    fetcher = WebFetcher(str(tmp_path), threads=8, min_interval=0.2)
+    recorded = turns(fetcher, clock, monkeypatch)
+    urls = [url(server, f"/page{i}", host) for host in ("127.0.0.1", "localhost") for i in range(6)]
+    assert all(page.ok for page in fetcher.fetch_all(urls).values())
+
+    assert sorted(len(times) for times in recorded.values()) == [6, 6]
+    for times in recorded.values():
+        assert all(b - a >= 0.2 - 1e-9 for a, b in zip(times, times[1:]))
+
+def test_failures_are_reported_per_url(server, tmp_path):
+    with socket.socket() as probe: # porta libera senza server in ascolto
+        probe.bind(("127.0.0.1", 0))
+        closed = f"http://127.0.0.1:{probe.getsockname()[1]}/page"
+    fetcher = WebFetcher(str(tmp_path), min_interval=0, timeout=2)
+    good, missing = url(server, "/page0"), url(server, "/missing")
+    pages = fetcher.fetch_all([good, missing, closed])
+
+    assert set(pages) == {good, missing, closed}
+    assert pages[good].ok and pages[good].content == "contenuto di /page0"
+    assert not pages[missing].ok and pages[missing].status == 404 and pages[missing].error == "HTTP 404"
+    assert not pages[closed].ok and pages[closed].status == 0 and pages[closed].error
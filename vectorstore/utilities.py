@@ -1,3 +1,6 @@
+from langchain_cohere import CohereEmbeddings
+from langchain_core.embeddings import Embeddings
+from local_embeddings import LocalEmbeddings
 import yaml
 
 def load_config(file_path="config.yaml") -> dict:
@@ -12,4 +15,26 @@ def load_config(file_path="config.yaml") -> dict:
     """
     with open(file_path, 'r') as file:
         config = yaml.safe_load(file)
-    return config
\ No newline at end of file
+    return config
+
+def get_embedder(config: dict) -> Embeddings:
+    """
+    Create the embedder used to build the database
+    
+    Args:
+        config (dict): Configuration
+    
+    Returns:
+        Embeddings: CohereEmbeddings or a local sentence-transformers model
+    """
+    if config["embedder_backend"] == "local":
+        local = config["local_models"]
+        return LocalEmbeddings(
+            config["embedder"],
+            batch_size=local["batch_size"],
+            onnx=local["onnx"],
+            threads=local["threads"],
+            query_prefix=local["query_prefix"],
+            document_prefix=local["document_prefix"]
+        )
+    return CohereEmbeddings(model=config["embedder"])
\ No newline at end of file
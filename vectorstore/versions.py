@@ -0,0 +1,83 @@
+from datetime import datetime
+import shutil
+import os
+
+CURRENT_FILE = "CURRENT"
+VERSIONS_DIR = "versions"
+
+def current(root: str) -> str | None:
+    """
+    Directory of the published version of the database
+
+    Args:
+        root (str): Root of the database (paths.db)
+
+    Returns:
+        str | None: Path of the version, the root itself for a database built before
+        versioning, None if there is no database
+    """
+    pointer = os.path.join(root, CURRENT_FILE)
+    if os.path.exists(pointer):
+        with open(pointer, "r", encoding="utf-8") as file:
+            return os.path.join(root, VERSIONS_DIR, file.read().strip()) + os.sep
+    if os.path.exists(os.path.join(root, "index.faiss")):
+        return root
+    return None
+
+def create(root: str, base: str | None = None) -> str:
+    """
+    Create the directory of a new version, not visible to the chatbot until it is published
+
+    Args:
+        root (str): Root of the database
+        base (str | None): Version to copy, for incremental updates
+
+    Returns:
+        str: Path of the new version
+    """
+    path = os.path.join(root, VERSIONS_DIR, datetime.now().strftime("%Y%m%d-%H%M%S-%f")) + os.sep
+    os.makedirs(path)
+    if base:
+        # copia e non hard link: FAISS e pickle riscrivono i file esistenti
+        for name in os.listdir(base):
+            source = os.path.join(base, name)
+            if os.path.isfile(source) and name != CURRENT_FILE:
+                shutil.copy2(source, os.path.join(path, name))
+    return path
+
+def publish(root: str, path: str, keep: int = 2) -> None:
+    """
+    Make a version the current one, replacing the pointer atomically, and remove the
+    oldest versions. The previous ones are kept for the chatbots still reading them, and
+    the version current until now is never removed: a chatbot may not have swapped yet.
+
+    Args:
+        root (str): Root of the database
+        path (str): Path of the version
+        keep (int): Versions kept on disk, including the new one
+    """
+    name = os.path.basename(os.path.normpath(path))
+    pointer = os.path.join(root, CURRENT_FILE)
+    previous = None
+    if os.path.exists(pointer):
+        with open(pointer, "r", encoding="utf-8") as file:
+            previous = file.read().strip()
+    with open(pointer + ".tmp", "w", encoding="utf-8") as file:
+        file.write(name)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(pointer + ".tmp", pointer)
+    print(f"\33[1;32m[Versions]\33[0m: Versione {name} pubblicata")
+
+    versions = sorted(os.listdir(os.path.join(root, VERSIONS_DIR)))
+    for old in versions[:-keep] if keep else []:
+        if old not in (name, previous):
+            # su Windows i file ancora aperti da un chatbot non si possono eliminare: si riprova alla prossima build
+            shutil.rmtree(os.path.join(root, VERSIONS_DIR, old), ignore_errors=True)
+
+def discard(path: str) -> None:
+    """
+    Remove a version that failed to build
+    """
+    shutil.rmtree(path, ignore_errors=True)
+    print(f"\33[1;31m[Versions]\33[0m: Versione {os.path.basename(os.path.normpath(path))} scartata")
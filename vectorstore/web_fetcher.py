@@ -0,0 +1,126 @@
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from urllib.parse import urlparse
+from collections import defaultdict
+from time import monotonic, sleep
+import requests
+import threading
+import hashlib
+import json
+import os
+
+class WebPage():
+    def __init__(self, url: str, status: int = 0, content: str = None, unchanged: bool = False, error: str = None):
+        self.url = url
+        self.status = status
+        self.content = content
+        self.unchanged = unchanged
+        self.error = error
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None and self.content is not None
+
+class WebFetcher():
+    """
+    Fetch web pages concurrently over a shared connection pool, with a minimum interval
+    between requests to the same host and a local HTTP cache validated with ETag/Last-Modified.
+    """
+    def __init__(self, cache_dir: str, threads: int = 8, min_interval: float = 0.5, timeout: float = 20):
+        self.cache_dir = cache_dir
+        self.threads = threads
+        self.min_interval = min_interval
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=threads,
+            pool_maxsize=threads,
+            max_retries=Retry(total=2, backoff_factor=0.5, status_forcelist=[502, 503, 504])
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.host_locks = defaultdict(threading.Lock)
+        self.host_last = {}
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def wait_turn(self, url: str) -> None:
+        """
+        Wait until the host of the url can receive another request
+        """
+        host = urlparse(url).netloc
+        with self.host_locks[host]:
+            wait = self.host_last.get(host, 0) + self.min_interval - monotonic()
+            if wait > 0:
+                sleep(wait)
+            self.host_last[host] = monotonic()
+
+    def cache_path(self, url: str) -> str:
+        return os.path.join(self.cache_dir, hashlib.sha1(url.encode("utf-8")).hexdigest() + ".json")
+
+    def load_cached(self, url: str) -> dict | None:
+        try:
+            with open(self.cache_path(url), "r", encoding="utf-8") as file:
+                return json.load(file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def save_cached(self, url: str, response: requests.Response) -> None:
+        entry = {
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "content": response.text
+        }
+        path = self.cache_path(url)
+        with open(path + ".tmp", "w", encoding="utf-8") as file:
+            json.dump(entry, file)
+        os.replace(path + ".tmp", path)
+
+    def fetch(self, url: str) -> WebPage:
+        """
+        Fetch a page with a conditional request if it is in the cache
+
+        Args:
+            url (str): Url of the page
+
+        Returns:
+            WebPage: The page, marked as unchanged if the server answered 304 or the content is identical
+        """
+        cached = self.load_cached(url)
+        headers = {}
+        if cached:
+            if cached["etag"]:
+                headers["If-None-Match"] = cached["etag"]
+            if cached["last_modified"]:
+                headers["If-Modified-Since"] = cached["last_modified"]
+        try:
+            self.wait_turn(url)
+            response = self.session.get(url, headers=headers, timeout=self.timeout)
+        except requests.RequestException as e:
+            return WebPage(url, error=str(e))
+
+        if response.status_code == 304 and cached:
+            return WebPage(url, status=304, content=cached["content"], unchanged=True)
+        if response.status_code != 200:
+            return WebPage(url, status=response.status_code, error=f"HTTP {response.status_code}")
+        if response.encoding is None or response.encoding == "ISO-8859-1":
+            response.encoding = "utf-8"
+        unchanged = cached is not None and cached["content"] == response.text
+        self.save_cached(url, response)
+        return WebPage(url, status=200, content=response.text, unchanged=unchanged)
+
+    def fetch_all(self, urls: list[str]) -> dict[str, WebPage]:
+        """
+        Fetch the pages concurrently
+
+        Args:
+            urls (list[str]): Urls of the pages
+
+        Returns:
+            dict[str, WebPage]: Pages by url
+        """
+        with ThreadPoolExecutor(max_workers=self.threads) as executor:
+            pages = list(executor.map(self.fetch, urls))
+        unchanged = sum(page.unchanged for page in pages)
+        print(f"\33[1;34m[WebFetcher]\33[0m: Scaricate {len(pages)} pagine ({unchanged} invariate)")
+        return {page.url: page for page in pages}